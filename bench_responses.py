@@ -0,0 +1,82 @@
+"""
+Per-response encode cost of a GET /v1/deliveries page (see schemas.py).
+
+    python bench_responses.py [rows] [repeat]
+
+"jsonable_encoder" is what FastAPI does without a response_model: walk the
+dict through jsonable_encoder, then json.dumps it (as JSONResponse.render).
+"response_model" is what it does with one: validate against DeliveryList,
+then serialize to JSON bytes with pydantic-core.
+"""
+import json
+import sys
+import time
+import uuid
+
+from fastapi.encoders import jsonable_encoder
+from pydantic import TypeAdapter
+
+from schemas import DeliveryList
+
+def delivery_page(rows: int) -> dict:
+    # The shape list_deliveries_for_user returns, one sqlite row per dict
+    return {
+        "user_id": "u1",
+        "deliveries": [
+            {
+                "id": f"dly_{uuid.uuid4().hex}",
+                "user_id": "u1",
+                "source": "stripe",
+                "destination_url": "https://example.com/hooks/stripe",
+                "event_type": "invoice.paid",
+                "occurred_at": "2024-05-01T12:00:00.000000Z",
+                "status": "failed" if i % 10 == 0 else "delivered",
+                "attempts": 3 if i % 10 == 0 else 1,
+                "last_error": "HTTP 503" if i % 10 == 0 else None,
+                "event_id": f"evt_{uuid.uuid4().hex}",
+                "destination_id": f"dst_{uuid.uuid4().hex}",
+                "deadline_at": None,
+            }
+            for i in range(rows)
+        ],
+        "next_cursor": "2024-05-01T12:00:00.000000Z|dly_0",
+    }
+
+def encode_jsonable(page: dict) -> bytes:
+    return json.dumps(
+        jsonable_encoder(page),
+        ensure_ascii=False,
+        allow_nan=False,
+        indent=None,
+        separators=(",", ":"),
+    ).encode("utf-8")
+
+def encode_response_model(adapter: TypeAdapter, page: dict) -> bytes:
+    return adapter.dump_json(adapter.validate_python(page))
+
+def best_of(fn, repeat: int) -> float:
+    fn()  # warm up
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+
+    page = delivery_page(rows)
+    adapter = TypeAdapter(DeliveryList)
+    assert json.loads(encode_jsonable(page)) == json.loads(encode_response_model(adapter, page))
+
+    before = best_of(lambda: encode_jsonable(page), repeat)
+    after = best_of(lambda: encode_response_model(adapter, page), repeat)
+    print(f"{rows}-row DeliveryList, best of {repeat}:")
+    print(f"  jsonable_encoder + json.dumps  {before * 1000:8.2f} ms")
+    print(f"  validate + dump_json           {after * 1000:8.2f} ms")
+    print(f"  {before / after:.1f}x less per response")
+
+if __name__ == "__main__":
+    main()
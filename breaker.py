@@ -0,0 +1,115 @@
+import os
+import time
+from collections import deque
+
+# A destination's breaker opens when at least BREAKER_FAILURE_RATE of its last
+# BREAKER_WINDOW attempts failed (once BREAKER_MIN_REQUESTS have been seen).
+# After BREAKER_OPEN_SECONDS it goes half-open and lets BREAKER_HALF_OPEN_PROBES
+# attempts through: a success closes it, a failure opens it again.
+BREAKER_WINDOW = int(os.getenv("BREAKER_WINDOW", "20"))
+BREAKER_MIN_REQUESTS = int(os.getenv("BREAKER_MIN_REQUESTS", "5"))
+BREAKER_FAILURE_RATE = float(os.getenv("BREAKER_FAILURE_RATE", "0.5"))
+BREAKER_OPEN_SECONDS = float(os.getenv("BREAKER_OPEN_SECONDS", "30.0"))
+BREAKER_HALF_OPEN_PROBES = int(os.getenv("BREAKER_HALF_OPEN_PROBES", "1"))
+# While half-open, attempts beyond the probes are parked for this long
+BREAKER_PROBE_WAIT_SECONDS = float(os.getenv("BREAKER_PROBE_WAIT_SECONDS", "2.0"))
+# A closed breaker unused this long is dropped (see CircuitBreaker.is_idle)
+BREAKER_IDLE_SECONDS = float(os.getenv("BREAKER_IDLE_SECONDS", "300.0"))
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+class CircuitBreaker:
+    """
+    Per-destination circuit breaker. Not thread-safe; used from the worker's
+    event loop only.
+    """
+
+    def __init__(self):
+        self.state = CLOSED
+        self.outcomes = deque(maxlen=BREAKER_WINDOW)  # True = success
+        self.open_until = 0.0
+        self.probes = 0
+        self.trips = 0
+        self.last_used = time.time()
+
+    def failure_rate(self) -> float:
+        if not self.outcomes:
+            return 0.0
+        return self.outcomes.count(False) / len(self.outcomes)
+
+    def is_open(self) -> bool:
+        """Open and still cooling down (no attempt would be allowed)."""
+        return self.state == OPEN and time.time() < self.open_until
+
+    def is_idle(self, now: float) -> bool:
+        """
+        Closed and unused for BREAKER_IDLE_SECONDS: its window is stale and
+        a fresh breaker would behave the same, so the caller can drop it.
+        """
+        return self.state == CLOSED and now - self.last_used >= BREAKER_IDLE_SECONDS
+
+    def allow(self) -> bool:
+        """
+        Whether an attempt may go out now. In half-open state an allowed
+        attempt is a probe: check is_probing() right after, and pass that to
+        record().
+        """
+        self.last_used = time.time()
+        if self.state == OPEN:
+            if time.time() < self.open_until:
+                return False
+            self.state = HALF_OPEN
+            self.probes = 0
+        if self.state == HALF_OPEN:
+            if self.probes >= BREAKER_HALF_OPEN_PROBES:
+                return False
+            self.probes += 1
+        return True
+
+    def is_probing(self) -> bool:
+        return self.state == HALF_OPEN
+
+    def retry_at(self) -> float:
+        """When a parked attempt should be tried again."""
+        if self.state == OPEN:
+            return self.open_until
+        return time.time() + BREAKER_PROBE_WAIT_SECONDS
+
+    def record(self, success: bool, probe: bool = False):
+        self.last_used = time.time()
+        if self.state == HALF_OPEN:
+            if not probe:
+                return  # attempt started before the breaker opened
+            self.probes = max(self.probes - 1, 0)
+            if success:
+                self.state = CLOSED
+                self.outcomes.clear()
+            else:
+                self._trip()
+            return
+
+        if self.state == OPEN:
+            return  # attempt started before the breaker opened (or a late probe)
+
+        self.outcomes.append(success)
+        if (
+            len(self.outcomes) >= BREAKER_MIN_REQUESTS
+            and self.failure_rate() >= BREAKER_FAILURE_RATE
+        ):
+            self._trip()
+
+    def _trip(self):
+        self.state = OPEN
+        self.open_until = time.time() + BREAKER_OPEN_SECONDS
+        self.probes = 0
+        self.trips += 1
+
+    def snapshot(self) -> dict:
+        return {
+            "state": self.state,
+            "failure_rate": round(self.failure_rate(), 3),
+            "open_until": self.open_until if self.state == OPEN else None,
+            "trips": self.trips,
+        }
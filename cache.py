@@ -0,0 +1,106 @@
+import itertools
+import threading
+import time
+from collections import OrderedDict
+
+MISSING = object()
+
+class TTLCache:
+    """
+    Small thread-safe LRU cache whose entries also expire after `ttl` seconds.
+    Keeps hit/miss/eviction counters so callers can expose them as metrics.
+
+    Loaders that read outside the lock take generation(key) first and pass it
+    to set(); if invalidate(key) ran in between, the stale value is dropped.
+
+    With `maxbytes`, values (bytes-like) are also bounded by their total len():
+    LRU entries are evicted to fit, and a value larger than maxbytes on its
+    own is not cached at all.
+    """
+
+    def __init__(self, maxsize: int, ttl: float, maxbytes: int | None = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.maxbytes = maxbytes
+        self._data = OrderedDict()  # key -> (expires_at, value, size)
+        self._bytes = 0  # sum of the sizes in _data (only tracked with maxbytes)
+        self._lock = threading.Lock()
+        # key -> generation of its last invalidation, pruned LRU at maxsize.
+        # A pruned key reports _generation_floor, which is at least every
+        # generation handed out before, so an in-flight loader still sees a change.
+        self._generations = OrderedDict()
+        self._generation_counter = itertools.count(1)
+        self._generation_floor = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=MISSING):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[0] > now:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                self._pop(key)
+            self.misses += 1
+            return default
+
+    def generation(self, key) -> int:
+        with self._lock:
+            return self._generations.get(key, self._generation_floor)
+
+    def set(self, key, value, generation: int | None = None):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            if generation is not None and generation != self._generations.get(key, self._generation_floor):
+                return  # invalidated while the value was being loaded
+            size = len(value) if self.maxbytes is not None else 0
+            self._pop(key)
+            if self.maxbytes is not None and size > self.maxbytes:
+                return
+            self._data[key] = (time.monotonic() + self.ttl, value, size)
+            self._bytes += size
+            while len(self._data) > self.maxsize or (
+                self.maxbytes is not None and self._bytes > self.maxbytes
+            ):
+                _, (_, _, evicted_size) = self._data.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+
+    def _pop(self, key):
+        entry = self._data.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[2]
+
+    def invalidate(self, key):
+        with self._lock:
+            self._pop(key)
+            self._generations[key] = next(self._generation_counter)
+            self._generations.move_to_end(key)
+            while len(self._generations) > self.maxsize:
+                _, pruned = self._generations.popitem(last=False)
+                self._generation_floor = max(self._generation_floor, pruned)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+            if self.maxbytes is not None:
+                stats["bytes"] = self._bytes
+                stats["maxbytes"] = self.maxbytes
+            return stats
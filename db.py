@@ -1,13 +1,107 @@
+import asyncio
+import bisect
+import os
 import sqlite3
+import threading
+import time
+import zlib
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
+from cache import TTLCache, MISSING
+from fastjson import dumps
+
 DB_PATH = Path(__file__).parent / "app.db"
 
-def get_conn():
-    conn = sqlite3.connect(DB_PATH)
+# sqlite3 calls block, so the *_async functions run them on this pool instead
+# of the event loop. Each thread keeps its own connection (see get_conn).
+DB_THREADS = int(os.getenv("DB_THREADS", "4"))
+_executor = ThreadPoolExecutor(max_workers=DB_THREADS, thread_name_prefix="db")
+
+# Connection tuning (see https://www.sqlite.org/pragma.html)
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", "16384"))
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(128 * 1024 * 1024)))
+
+# One long-lived connection per thread, opened on first use and reused for
+# every query on that thread. All of them are tracked so close_db() can shut
+# them down; bumping the generation makes every thread reconnect afterwards.
+_local = threading.local()
+_all_conns = []
+_all_conns_lock = threading.Lock()
+_generation = 0
+
+def _connect():
+    conn = sqlite3.connect(DB_PATH, check_same_thread=False)
     conn.row_factory = sqlite3.Row
+    # WAL lets readers run concurrently with the (single) writer; with WAL,
+    # synchronous=NORMAL only fsyncs at checkpoints and is still crash-safe.
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    conn.execute(f"PRAGMA cache_size=-{SQLITE_CACHE_SIZE_KB}")
+    conn.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+    conn.execute("PRAGMA temp_store=MEMORY")
     return conn
 
+# Active destination per user_id. Destinations change rarely, so ingest
+# resolves them from memory; every write to `destinations` goes through this
+# module and invalidates the user's entry (write-through). The TTL bounds
+# staleness when several processes share one database file.
+DESTINATION_CACHE_SIZE = int(os.getenv("DESTINATION_CACHE_SIZE", "10000"))
+DESTINATION_CACHE_TTL = float(os.getenv("DESTINATION_CACHE_TTL", "60.0"))
+destination_cache = TTLCache(maxsize=DESTINATION_CACHE_SIZE, ttl=DESTINATION_CACHE_TTL)
+# Destinations by id, for the delivery worker. A destination's settings never
+# change after creation, so this needs no invalidation.
+destination_by_id_cache = TTLCache(maxsize=DESTINATION_CACHE_SIZE, ttl=DESTINATION_CACHE_TTL)
+
+# Account settings per user_id, read on every ingest. Same write-through
+# invalidation and TTL as destination_cache.
+account_settings_cache = TTLCache(maxsize=DESTINATION_CACHE_SIZE, ttl=DESTINATION_CACHE_TTL)
+
+# delivery_stats buckets are the first STATS_BUCKET_CHARS characters of
+# occurred_at ("YYYY-MM-DDTHH"), i.e. one bucket per hour
+STATS_BUCKET_CHARS = 13
+
+# Event payloads at least this large are stored zlib-compressed
+EVENT_COMPRESS_MIN_BYTES = int(os.getenv("EVENT_COMPRESS_MIN_BYTES", "512"))
+EVENT_COMPRESS_LEVEL = int(os.getenv("EVENT_COMPRESS_LEVEL", "6"))
+
+# Group commit: delivery writes queued by the *_async functions are flushed
+# in one transaction per batch of up to WRITE_BATCH_MAX_ROWS, waiting at most
+# WRITE_BATCH_MAX_DELAY_MS for a batch to fill.
+WRITE_BATCH_MAX_ROWS = int(os.getenv("WRITE_BATCH_MAX_ROWS", "256"))
+WRITE_BATCH_MAX_DELAY_MS = float(os.getenv("WRITE_BATCH_MAX_DELAY_MS", "5"))
+
+_write_queue: asyncio.Queue | None = None
+_writer_task: asyncio.Task | None = None
+
+writer_stats = {"batches": 0, "writes": 0, "max_batch": 0, "errors": 0}
+
+def get_conn():
+    conn = getattr(_local, "conn", None)
+    if conn is None or _local.generation != _generation:
+        conn = _connect()
+        with _all_conns_lock:
+            _all_conns.append(conn)
+            _local.conn = conn
+            _local.generation = _generation
+    return conn
+
+async def run_db(fn, *args):
+    """Run a blocking db function on the DB thread pool and await its result."""
+    return await asyncio.get_running_loop().run_in_executor(_executor, fn, *args)
+
+def close_db():
+    global _generation
+    with _all_conns_lock:
+        conns = list(_all_conns)
+        _all_conns.clear()
+        _generation += 1
+    for conn in conns:
+        conn.close()
+
 def init_db():
     conn = get_conn()
     cur = conn.cursor()
@@ -19,9 +113,28 @@ def init_db():
         user_id TEXT NOT NULL,
         url TEXT NOT NULL,
         active INTEGER NOT NULL,
-        created_at TEXT NOT NULL
+        created_at TEXT NOT NULL,
+        batch_max_items INTEGER,       -- outbound batching; NULL = one event per POST
+        batch_max_wait_ms INTEGER,
+        batch_max_bytes INTEGER,
+        max_in_flight INTEGER,         -- concurrent deliveries; NULL = worker default
+        timeout_connect REAL,          -- per-attempt HTTP timeouts in seconds;
+        timeout_read REAL,             -- NULL = worker default
+        timeout_write REAL,
+        timeout_pool REAL,
+        deadline_seconds REAL,         -- give up this long after queueing; NULL = never
+        envelope_version INTEGER NOT NULL DEFAULT 1  -- see envelope.py
     )
     """)
+    _ensure_column(cur, "destinations", "batch_max_items", "INTEGER")
+    _ensure_column(cur, "destinations", "batch_max_wait_ms", "INTEGER")
+    _ensure_column(cur, "destinations", "batch_max_bytes", "INTEGER")
+    _ensure_column(cur, "destinations", "max_in_flight", "INTEGER")
+    for column in ("timeout_connect", "timeout_read", "timeout_write", "timeout_pool", "deadline_seconds"):
+        _ensure_column(cur, "destinations", column, "REAL")
+    _ensure_column(cur, "destinations", "envelope_version", "INTEGER NOT NULL DEFAULT 1")
+    # Destinations from before the column was NOT NULL keep the original shape
+    cur.execute("UPDATE destinations SET envelope_version = 1 WHERE envelope_version IS NULL")
 
     # Deliveries (one per event forwarding attempt sequence)
     cur.execute("""
@@ -34,41 +147,227 @@ def init_db():
         occurred_at TEXT NOT NULL,
         status TEXT NOT NULL,          -- pending, delivered, failed
         attempts INTEGER NOT NULL,
-        last_error TEXT
+        last_error TEXT,
+        event_id TEXT,
+        next_attempt_at REAL,          -- unix time; set only while pending
+        claimed_by TEXT,               -- worker id holding the current lease
+        destination_id TEXT,
+        deadline_at REAL               -- unix time after which it's failed; NULL = none
+    )
+    """)
+    # Columns added after the first release
+    _ensure_column(cur, "deliveries", "event_id", "TEXT")
+    _ensure_column(cur, "deliveries", "next_attempt_at", "REAL")
+    _ensure_column(cur, "deliveries", "claimed_by", "TEXT")
+    _ensure_column(cur, "deliveries", "destination_id", "TEXT")
+    _ensure_column(cur, "deliveries", "deadline_at", "REAL")
+
+    # Event payloads, stored once and referenced by deliveries.event_id, so
+    # queued deliveries survive restarts and can be replayed later
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS events (
+        id TEXT PRIMARY KEY,
+        payload BLOB NOT NULL,         -- serialized JSON, see encoding
+        encoding TEXT NOT NULL DEFAULT 'json'  -- json, zlib (compressed json)
+    )
+    """)
+    _ensure_column(cur, "events", "encoding", "TEXT NOT NULL DEFAULT 'json'")
+
+    # Last known circuit breaker state per destination URL, written by the
+    # delivery worker on state changes so the API can report it
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS circuit_breakers (
+        destination_url TEXT PRIMARY KEY,
+        state TEXT NOT NULL,           -- closed, open, half_open
+        failure_rate REAL NOT NULL,
+        open_until REAL,
+        trips INTEGER NOT NULL,
+        updated_at REAL NOT NULL
     )
     """)
 
+    # Account-level settings (PUT /v1/account/settings); a missing row or
+    # NULL column means the default
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS account_settings (
+        user_id TEXT PRIMARY KEY,
+        ingest_response TEXT,          -- full, minimal
+        updated_at TEXT NOT NULL
+    )
+    """)
+
+    # Delivery counts per user, hour of occurred_at, source, event_type and
+    # status. _insert_deliveries and _update_delivery keep it in step with
+    # `deliveries` in the same transaction, so GET /v1/stats reads O(buckets)
+    # rows instead of scanning deliveries.
+    stats_exist = cur.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'delivery_stats'"
+    ).fetchone()
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS delivery_stats (
+        user_id TEXT NOT NULL,
+        bucket TEXT NOT NULL,          -- see STATS_BUCKET_CHARS
+        source TEXT NOT NULL,
+        event_type TEXT NOT NULL,
+        status TEXT NOT NULL,
+        count INTEGER NOT NULL,
+        PRIMARY KEY (user_id, bucket, source, event_type, status)
+    ) WITHOUT ROWID
+    """)
+    if not stats_exist:
+        # Database from before the rollup existed: build it once
+        cur.execute(f"""
+            INSERT INTO delivery_stats
+            SELECT user_id, substr(occurred_at, 1, {STATS_BUCKET_CHARS}), source, event_type, status, COUNT(*)
+            FROM deliveries
+            GROUP BY 1, 2, 3, 4, 5
+        """)
+
+    # Secondary indexes for the per-user listings. IF NOT EXISTS also
+    # migrates databases created before the indexes existed.
+    # list_deliveries_for_user: WHERE user_id = ? [AND (occurred_at, id) < cursor]
+    # ORDER BY occurred_at DESC, id DESC -- a keyset page is one index range.
+    # Replaces the older (user_id, occurred_at) index, a prefix of this one.
+    cur.execute("""
+    CREATE INDEX IF NOT EXISTS idx_deliveries_user_occurred_id
+    ON deliveries (user_id, occurred_at, id)
+    """)
+    cur.execute("DROP INDEX IF EXISTS idx_deliveries_user_occurred")
+    # list_destinations_db: WHERE user_id = ? ORDER BY created_at
+    cur.execute("""
+    CREATE INDEX IF NOT EXISTS idx_destinations_user_created
+    ON destinations (user_id, created_at)
+    """)
+    # Active destination lookup: WHERE user_id = ? AND active = 1 ORDER BY created_at
+    cur.execute("""
+    CREATE INDEX IF NOT EXISTS idx_destinations_user_active_created
+    ON destinations (user_id, active, created_at)
+    """)
+    # Delivery queue: pending rows ordered by when they are due
+    cur.execute("""
+    CREATE INDEX IF NOT EXISTS idx_deliveries_due
+    ON deliveries (next_attempt_at) WHERE status = 'pending'
+    """)
+    # ...and per user, for fair (round-robin) claiming across tenants
+    cur.execute("""
+    CREATE INDEX IF NOT EXISTS idx_deliveries_pending_user
+    ON deliveries (user_id, next_attempt_at) WHERE status = 'pending'
+    """)
+    # ...and by lease holder, for the startup sweep of a worker's stale leases
+    cur.execute("""
+    CREATE INDEX IF NOT EXISTS idx_deliveries_claimed
+    ON deliveries (claimed_by, next_attempt_at)
+    WHERE status = 'pending' AND claimed_by IS NOT NULL
+    """)
+
     conn.commit()
-    conn.close()
 
-def create_delivery(delivery: dict):
+def _ensure_column(cur, table: str, column: str, decl: str):
+    cur.execute(f"PRAGMA table_info({table})")
+    if column not in {r["name"] for r in cur.fetchall()}:
+        cur.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+
+def create_delivery(delivery: dict, payload: dict | None = None):
     """
     delivery keys expected:
     id, user_id, source, destination_url, event_type, occurred_at,
-    status, attempts, last_error
+    status, attempts, last_error, event_id, next_attempt_at, destination_id,
+    deadline_at (optional)
+
+    If payload is given it is stored under delivery["event_id"] in the
+    same transaction, so a queued delivery never exists without its event.
     """
     conn = get_conn()
-    cur = conn.cursor()
+    _insert_deliveries(conn.cursor(), [delivery], [payload])
+    conn.commit()
 
-    cur.execute("""
+async def create_delivery_async(delivery: dict, payload: dict | None = None):
+    """create_delivery() through the group-commit writer."""
+    await _submit_write(_insert_deliveries, [delivery], [payload])
+
+async def create_deliveries_async(deliveries: list[dict], payloads: list[dict | None]):
+    """
+    Insert many deliveries (and their payloads, matched by position) as one
+    write in the group-commit writer: all of them commit or none do.
+    """
+    await _submit_write(_insert_deliveries, deliveries, payloads)
+
+def _insert_deliveries(cur, deliveries: list[dict], payloads: list[dict | None]):
+    cur.executemany(
+        "INSERT INTO events (id, payload, encoding) VALUES (?, ?, ?)",
+        [
+            (d["event_id"], *_encode_payload(p))
+            for d, p in zip(deliveries, payloads)
+            if p is not None
+        ]
+    )
+
+    cur.executemany("""
         INSERT INTO deliveries (
             id, user_id, source, destination_url, event_type, occurred_at,
-            status, attempts, last_error
-        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-    """, (
-        delivery["id"],
-        delivery["user_id"],
-        delivery["source"],
-        delivery["destination_url"],
-        delivery["event_type"],
-        delivery["occurred_at"],
-        delivery["status"],
-        delivery["attempts"],
-        delivery.get("last_error")
-    ))
+            status, attempts, last_error, event_id, next_attempt_at, destination_id,
+            deadline_at
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, [
+        (
+            d["id"],
+            d["user_id"],
+            d["source"],
+            d["destination_url"],
+            d["event_type"],
+            d["occurred_at"],
+            d["status"],
+            d["attempts"],
+            d.get("last_error"),
+            d.get("event_id"),
+            d.get("next_attempt_at"),
+            d.get("destination_id"),
+            d.get("deadline_at")
+        )
+        for d in deliveries
+    ])
 
-    conn.commit()
-    conn.close()
+    counts = Counter(
+        (d["user_id"], d["occurred_at"][:STATS_BUCKET_CHARS], d["source"], d["event_type"], d["status"])
+        for d in deliveries
+    )
+    cur.executemany(_COUNT_DELIVERIES, [(*key, n) for key, n in counts.items()])
+
+# Adds to a delivery_stats counter (count may be negative)
+_COUNT_DELIVERIES = """
+    INSERT INTO delivery_stats (user_id, bucket, source, event_type, status, count)
+    VALUES (?, ?, ?, ?, ?, ?)
+    ON CONFLICT (user_id, bucket, source, event_type, status) DO UPDATE SET
+        count = count + excluded.count
+"""
+
+def _encode_payload(payload: dict):
+    # The one time a payload is serialized; deliveries reuse these bytes
+    data = dumps(payload)
+    if len(data) >= EVENT_COMPRESS_MIN_BYTES:
+        return zlib.compress(data, EVENT_COMPRESS_LEVEL), "zlib"
+    return data, "json"
+
+def _payload_json(data, encoding: str) -> bytes:
+    if encoding == "zlib":
+        return zlib.decompress(data)
+    return bytes(data)
+
+def get_event_payload_json(event_id: str):
+    """The stored payload as JSON bytes (decompressed, not parsed), or None."""
+    conn = get_conn()
+    cur = conn.cursor()
+
+    cur.execute("SELECT payload, encoding FROM events WHERE id = ?", (event_id,))
+    row = cur.fetchone()
+
+    if not row:
+        return None
+
+    return _payload_json(row["payload"], row["encoding"])
+
+async def get_event_payload_json_async(event_id: str):
+    return await run_db(get_event_payload_json, event_id)
 
 def get_delivery(delivery_id: str):
     conn = get_conn()
@@ -76,63 +375,493 @@ def get_delivery(delivery_id: str):
 
     cur.execute("SELECT * FROM deliveries WHERE id = ?", (delivery_id,))
     row = cur.fetchone()
-    conn.close()
 
     if not row:
         return None
 
     return dict(row)
 
-def update_delivery(delivery_id: str, status: str, attempts: int, last_error: str | None):
+async def get_delivery_async(delivery_id: str):
+    return await run_db(get_delivery, delivery_id)
+
+def update_delivery(
+    delivery_id: str,
+    status: str,
+    attempts: int,
+    last_error: str | None,
+    next_attempt_at: float | None = None
+):
     conn = get_conn()
-    cur = conn.cursor()
+    _update_delivery(conn.cursor(), delivery_id, status, attempts, last_error, next_attempt_at)
+    conn.commit()
+
+async def update_delivery_async(
+    delivery_id: str,
+    status: str,
+    attempts: int,
+    last_error: str | None,
+    next_attempt_at: float | None = None
+):
+    """update_delivery() through the group-commit writer."""
+    await _submit_write(
+        _update_delivery, delivery_id, status, attempts, last_error, next_attempt_at
+    )
+
+def _update_delivery(cur, delivery_id, status, attempts, last_error, next_attempt_at):
+    # The old status, to move the row between delivery_stats counters
+    cur.execute("""
+        SELECT user_id, occurred_at, source, event_type, status
+        FROM deliveries WHERE id = ?
+    """, (delivery_id,))
+    old = cur.fetchone()
 
     cur.execute("""
         UPDATE deliveries
-        SET status = ?, attempts = ?, last_error = ?
+        SET status = ?, attempts = ?, last_error = ?, next_attempt_at = ?, claimed_by = NULL
         WHERE id = ?
-    """, (status, attempts, last_error, delivery_id))
+    """, (status, attempts, last_error, next_attempt_at, delivery_id))
+
+    if old is not None and old["status"] != status:
+        key = (old["user_id"], old["occurred_at"][:STATS_BUCKET_CHARS], old["source"], old["event_type"])
+        cur.executemany(_COUNT_DELIVERIES, [(*key, old["status"], -1), (*key, status, 1)])
+
+async def start_writer():
+    global _write_queue, _writer_task
+    _write_queue = asyncio.Queue()
+    _writer_task = asyncio.create_task(_writer_loop(_write_queue))
+
+async def stop_writer():
+    """Flush everything queued so far, then stop. Later writes run unbatched."""
+    global _write_queue, _writer_task
+    if _writer_task is None:
+        return
+    _write_queue.put_nowait(None)
+    await _writer_task
+    _write_queue = None
+    _writer_task = None
+
+async def _submit_write(op, *args):
+    """
+    Queue op(cur, *args) for the next group commit and wait until that batch
+    is committed. Without a running writer the op is committed on its own.
+    """
+    if _write_queue is None:
+        [error] = await run_db(_run_write_batch, [(op, args)])
+        if error is not None:
+            raise error
+        return
+    fut = asyncio.get_running_loop().create_future()
+    _write_queue.put_nowait((op, args, fut))
+    await fut
+
+async def _writer_loop(queue: asyncio.Queue):
+    stopping = False
+    while not stopping:
+        item = await queue.get()
+        if item is None:
+            break
+        batch = [item]
+
+        # Give concurrent writers a moment to join this batch
+        if WRITE_BATCH_MAX_DELAY_MS > 0 and queue.qsize() < WRITE_BATCH_MAX_ROWS - 1:
+            await asyncio.sleep(WRITE_BATCH_MAX_DELAY_MS / 1000)
+        while len(batch) < WRITE_BATCH_MAX_ROWS and not queue.empty():
+            item = queue.get_nowait()
+            if item is None:
+                stopping = True
+                break
+            batch.append(item)
+
+        try:
+            errors = await run_db(_run_write_batch, [(op, args) for op, args, _ in batch])
+        except Exception as e:
+            errors = [e] * len(batch)
+
+        for (_, _, fut), error in zip(batch, errors):
+            if fut.done():
+                continue
+            if error is None:
+                fut.set_result(None)
+            else:
+                fut.set_exception(error)
+
+# Errors caused by one op's own data. Anything else (a locked or full
+# database, I/O errors) would hit every op again, so it fails the batch.
+_PER_OP_ERRORS = (sqlite3.IntegrityError, sqlite3.ProgrammingError, sqlite3.InterfaceError)
+
+def _run_write_batch(ops):
+    """
+    Run every op in a single transaction (one commit for the whole batch).
+    If one op's data broke it, retry each op in its own transaction so one
+    bad write doesn't fail the rest. Returns one exception-or-None per op.
+    """
+    conn = get_conn()
+    writer_stats["batches"] += 1
+    writer_stats["writes"] += len(ops)
+    writer_stats["max_batch"] = max(writer_stats["max_batch"], len(ops))
+    try:
+        with conn:
+            cur = conn.cursor()
+            for op, args in ops:
+                op(cur, *args)
+        return [None] * len(ops)
+    except _PER_OP_ERRORS as e:
+        if len(ops) == 1:
+            writer_stats["errors"] += 1
+            return [e]
+    except Exception as e:
+        writer_stats["errors"] += len(ops)
+        return [e] * len(ops)
+
+    errors = []
+    for op, args in ops:
+        try:
+            with conn:
+                op(conn.cursor(), *args)
+            errors.append(None)
+        except Exception as e:
+            writer_stats["errors"] += 1
+            errors.append(e)
+    return errors
+
+def claim_due_deliveries(
+    worker_id: str,
+    now: float,
+    lease_seconds: float,
+    limit: int,
+    per_user_limit: int,
+    user_quotas: dict | None = None,
+    after_user_id: str | None = None
+):
+    """
+    Claim up to `limit` pending deliveries whose next_attempt_at has passed,
+    fairly across tenants: users with due rows are visited round-robin,
+    starting after `after_user_id`, and each gets at most per_user_limit
+    rows (or user_quotas[user_id] when given), oldest first.
+
+    Claiming pushes next_attempt_at forward by lease_seconds instead of
+    changing status, so if the worker dies mid-attempt the row simply
+    becomes due again once the lease runs out.
+    """
+    conn = get_conn()
+    cur = conn.cursor()
+
+    # Users with due work. Walks idx_deliveries_pending_user one user at a
+    # time (a loose index scan), so it costs O(users), not O(backlog).
+    cur.execute("""
+        WITH RECURSIVE users(user_id) AS (
+            SELECT MIN(user_id) FROM deliveries WHERE status = 'pending'
+            UNION ALL
+            SELECT (
+                SELECT MIN(user_id) FROM deliveries
+                WHERE status = 'pending' AND user_id > users.user_id
+            )
+            FROM users WHERE users.user_id IS NOT NULL
+        )
+        SELECT user_id FROM users
+        WHERE user_id IS NOT NULL
+          AND (
+            SELECT MIN(next_attempt_at) FROM deliveries
+            WHERE status = 'pending' AND user_id = users.user_id
+          ) <= ?
+    """, (now,))
+    users = [r[0] for r in cur.fetchall()]
+
+    if after_user_id is not None:
+        start = bisect.bisect_right(users, after_user_id)
+        users = users[start:] + users[:start]
+
+    rows = []
+    for user_id in users:
+        if len(rows) >= limit:
+            break
+        quota = per_user_limit
+        if user_quotas and user_id in user_quotas:
+            quota = user_quotas[user_id]
+        quota = min(quota, limit - len(rows))
+        if quota <= 0:
+            continue
+
+        cur.execute("""
+            UPDATE deliveries
+            SET next_attempt_at = ?, claimed_by = ?
+            WHERE id IN (
+                SELECT id FROM deliveries
+                WHERE status = 'pending' AND user_id = ? AND next_attempt_at <= ?
+                ORDER BY next_attempt_at
+                LIMIT ?
+            )
+            RETURNING *
+        """, (now + lease_seconds, worker_id, user_id, now, quota))
+        rows.extend(cur.fetchall())
 
     conn.commit()
-    conn.close()
+    return [dict(r) for r in rows]
+
+async def claim_due_deliveries_async(
+    worker_id: str,
+    now: float,
+    lease_seconds: float,
+    limit: int,
+    per_user_limit: int,
+    user_quotas: dict | None = None,
+    after_user_id: str | None = None
+):
+    return await run_db(
+        claim_due_deliveries,
+        worker_id, now, lease_seconds, limit, per_user_limit, user_quotas, after_user_id
+    )
+
+async def renew_leases_async(worker_id: str, delivery_ids: list[str], until: float):
+    """Push the lease of rows this worker still holds out to `until`."""
+    await _submit_write(_renew_leases, worker_id, delivery_ids, until)
+
+def _renew_leases(cur, worker_id: str, delivery_ids: list[str], until: float):
+    cur.executemany("""
+        UPDATE deliveries
+        SET next_attempt_at = ?
+        WHERE id = ? AND claimed_by = ? AND status = 'pending'
+    """, [(until, delivery_id, worker_id) for delivery_id in delivery_ids])
+
+async def save_circuit_state_async(destination_url: str, snapshot: dict):
+    """Record a breaker state change (see breaker.CircuitBreaker.snapshot)."""
+    await _submit_write(_upsert_circuit_state, destination_url, snapshot, time.time())
+
+def _upsert_circuit_state(cur, destination_url: str, snapshot: dict, updated_at: float):
+    cur.execute("""
+        INSERT INTO circuit_breakers (
+            destination_url, state, failure_rate, open_until, trips, updated_at
+        ) VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT (destination_url) DO UPDATE SET
+            state = excluded.state,
+            failure_rate = excluded.failure_rate,
+            open_until = excluded.open_until,
+            trips = excluded.trips,
+            updated_at = excluded.updated_at
+    """, (
+        destination_url,
+        snapshot["state"],
+        snapshot["failure_rate"],
+        snapshot["open_until"],
+        snapshot["trips"],
+        updated_at
+    ))
+
+def get_circuit_state(destination_url: str):
+    conn = get_conn()
+    cur = conn.cursor()
 
-def list_deliveries_for_user(user_id: str, limit: int = 20):
+    cur.execute("SELECT * FROM circuit_breakers WHERE destination_url = ?", (destination_url,))
+    row = cur.fetchone()
+
+    if not row:
+        return None
+
+    return dict(row)
+
+async def get_circuit_state_async(destination_url: str):
+    return await run_db(get_circuit_state, destination_url)
+
+def requeue_orphaned_deliveries(worker_id: str, now: float, lease_cutoff: float, limit: int) -> int:
+    """
+    Make up to `limit` orphaned pending deliveries due now and return how many.
+
+    Orphaned means never queued (next_attempt_at is NULL, e.g. rows from
+    before the delivery queue existed) or leased to `worker_id` with a lease
+    ending before `lease_cutoff`. Pass the current run's start time plus the
+    lease length: leases this run takes (or renews) all end after that, so
+    only a previous run's leases match, even while this run is claiming.
+    """
     conn = get_conn()
     cur = conn.cursor()
 
+    # Two index ranges (idx_deliveries_due, idx_deliveries_claimed); rows
+    # requeued by earlier batches no longer match either, so each batch is
+    # O(limit) rather than a rescan of the pending backlog.
     cur.execute("""
+        UPDATE deliveries
+        SET next_attempt_at = ?, claimed_by = NULL
+        WHERE id IN (
+            SELECT id FROM deliveries
+            WHERE status = 'pending' AND next_attempt_at IS NULL
+            UNION ALL
+            SELECT id FROM deliveries
+            WHERE status = 'pending' AND claimed_by = ? AND next_attempt_at < ?
+            LIMIT ?
+        )
+    """, (now, worker_id, lease_cutoff, limit))
+
+    conn.commit()
+    return cur.rowcount
+
+async def requeue_orphaned_deliveries_async(
+    worker_id: str,
+    now: float,
+    lease_cutoff: float,
+    limit: int
+) -> int:
+    return await run_db(requeue_orphaned_deliveries, worker_id, now, lease_cutoff, limit)
+
+def list_deliveries_for_user(
+    user_id: str,
+    limit: int = 20,
+    after: tuple[str, str] | None = None,
+    status: str | None = None,
+    source: str | None = None,
+    event_type: str | None = None,
+    since: str | None = None,
+    until: str | None = None
+):
+    """
+    Newest first, by (occurred_at, id). `after` is the (occurred_at, id) of
+    the last row of the previous page; the page continues strictly below it,
+    so each page costs O(limit) however deep it is. since/until bound
+    occurred_at (inclusive/exclusive); the other filters match exactly.
+    """
+    conn = get_conn()
+    cur = conn.cursor()
+
+    where = ["user_id = ?"]
+    params = [user_id]
+    if after is not None:
+        where.append("(occurred_at, id) < (?, ?)")
+        params += after
+    for column, value in (("status", status), ("source", source), ("event_type", event_type)):
+        if value is not None:
+            where.append(f"{column} = ?")
+            params.append(value)
+    if since is not None:
+        where.append("occurred_at >= ?")
+        params.append(since)
+    if until is not None:
+        where.append("occurred_at < ?")
+        params.append(until)
+
+    cur.execute(f"""
         SELECT *
         FROM deliveries
-        WHERE user_id = ?
-        ORDER BY occurred_at DESC
+        WHERE {" AND ".join(where)}
+        ORDER BY occurred_at DESC, id DESC
         LIMIT ?
-    """, (user_id, limit))
+    """, (*params, limit))
+
+    rows = cur.fetchall()
+    return [dict(r) for r in rows]
+
+async def list_deliveries_for_user_async(
+    user_id: str,
+    limit: int = 20,
+    after: tuple[str, str] | None = None,
+    status: str | None = None,
+    source: str | None = None,
+    event_type: str | None = None,
+    since: str | None = None,
+    until: str | None = None
+):
+    return await run_db(
+        list_deliveries_for_user,
+        user_id, limit, after, status, source, event_type, since, until
+    )
+
+def get_delivery_stats(
+    user_id: str,
+    bucket_chars: int = STATS_BUCKET_CHARS,
+    since: str | None = None,
+    until: str | None = None,
+    source: str | None = None,
+    event_type: str | None = None
+):
+    """
+    Delivery counts from delivery_stats, grouped by bucket (occurred_at cut
+    to bucket_chars: 13 = hour, 10 = day), source, event_type and status.
+    since/until are occurred_at timestamps, rounded down to the hour.
+    """
+    conn = get_conn()
+    cur = conn.cursor()
+
+    where = ["user_id = ?", "count != 0"]
+    params = [user_id]
+    if since is not None:
+        where.append("bucket >= ?")
+        params.append(since[:STATS_BUCKET_CHARS])
+    if until is not None:
+        where.append("bucket < ?")
+        params.append(until[:STATS_BUCKET_CHARS])
+    for column, value in (("source", source), ("event_type", event_type)):
+        if value is not None:
+            where.append(f"{column} = ?")
+            params.append(value)
+
+    cur.execute(f"""
+        SELECT substr(bucket, 1, ?) AS period, source, event_type, status, SUM(count) AS count
+        FROM delivery_stats
+        WHERE {" AND ".join(where)}
+        GROUP BY 1, 2, 3, 4
+        ORDER BY 1, 2, 3, 4
+    """, (bucket_chars, *params))
 
     rows = cur.fetchall()
-    conn.close()
     return [dict(r) for r in rows]
 
+async def get_delivery_stats_async(
+    user_id: str,
+    bucket_chars: int = STATS_BUCKET_CHARS,
+    since: str | None = None,
+    until: str | None = None,
+    source: str | None = None,
+    event_type: str | None = None
+):
+    return await run_db(get_delivery_stats, user_id, bucket_chars, since, until, source, event_type)
+
 def create_destination_db(destination: dict):
     """
     destination keys expected:
-    id, user_id, url, active, created_at
+    id, user_id, url, active, created_at,
+    batch_max_items, batch_max_wait_ms, batch_max_bytes (None = no batching),
+    max_in_flight (None = worker default),
+    timeout_connect, timeout_read, timeout_write, timeout_pool (None = worker default),
+    deadline_seconds (None = no deadline),
+    envelope_version
     """
     conn = get_conn()
     cur = conn.cursor()
 
     cur.execute("""
-        INSERT INTO destinations (id, user_id, url, active, created_at)
-        VALUES (?, ?, ?, ?, ?)
+        INSERT INTO destinations (
+            id, user_id, url, active, created_at,
+            batch_max_items, batch_max_wait_ms, batch_max_bytes, max_in_flight,
+            timeout_connect, timeout_read, timeout_write, timeout_pool, deadline_seconds,
+            envelope_version
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
     """, (
         destination["id"],
         destination["user_id"],
         destination["url"],
         1 if destination["active"] else 0,
-        destination["created_at"]
+        destination["created_at"],
+        destination.get("batch_max_items"),
+        destination.get("batch_max_wait_ms"),
+        destination.get("batch_max_bytes"),
+        destination.get("max_in_flight"),
+        destination.get("timeout_connect"),
+        destination.get("timeout_read"),
+        destination.get("timeout_write"),
+        destination.get("timeout_pool"),
+        destination.get("deadline_seconds"),
+        destination["envelope_version"]
     ))
 
     conn.commit()
-    conn.close()
+    destination_cache.invalidate(destination["user_id"])
+
+async def create_destination_db_async(destination: dict):
+    await run_db(create_destination_db, destination)
+
+def _destination_from_row(row):
+    # Convert SQLite int active -> bool
+    d = dict(row)
+    d["active"] = bool(d["active"])
+    return d
 
 def list_destinations_db(user_id: str):
     conn = get_conn()
@@ -145,20 +874,92 @@ def list_destinations_db(user_id: str):
     """, (user_id,))
 
     rows = cur.fetchall()
-    conn.close()
+    return [_destination_from_row(r) for r in rows]
 
-    # Convert SQLite int active -> bool
-    results = []
-    for r in rows:
-        d = dict(r)
-        d["active"] = bool(d["active"])
-        results.append(d)
-
-    return results
-
-def get_active_destination_url(user_id: str):
-    destinations = list_destinations_db(user_id)
-    active = [d for d in destinations if d["active"]]
-    if not active:
-        return None
-    return active[-1]["url"]
+async def list_destinations_db_async(user_id: str):
+    return await run_db(list_destinations_db, user_id)
+
+async def get_active_destination_async(user_id: str):
+    """
+    Newest active destination for the user (dict), or None.
+    Served from destination_cache when possible (None is cached too);
+    only misses go to the DB thread pool.
+    """
+    destination = destination_cache.get(user_id)
+    if destination is MISSING:
+        destination = await run_db(_load_active_destination, user_id)
+    return destination
+
+def _load_active_destination(user_id: str):
+    # Single-row lookup on idx_destinations_user_active_created, then cached
+    # unless create_destination_db invalidated the user in the meantime
+    generation = destination_cache.generation(user_id)
+    conn = get_conn()
+    cur = conn.cursor()
+
+    cur.execute("""
+        SELECT * FROM destinations
+        WHERE user_id = ? AND active = 1
+        ORDER BY created_at DESC, rowid DESC
+        LIMIT 1
+    """, (user_id,))
+
+    row = cur.fetchone()
+    destination = _destination_from_row(row) if row else None
+    destination_cache.set(user_id, destination, generation)
+    return destination
+
+async def get_destination_async(destination_id: str):
+    destination = destination_by_id_cache.get(destination_id)
+    if destination is MISSING:
+        destination = await run_db(_load_destination, destination_id)
+    return destination
+
+def _load_destination(destination_id: str):
+    conn = get_conn()
+    cur = conn.cursor()
+
+    cur.execute("SELECT * FROM destinations WHERE id = ?", (destination_id,))
+    row = cur.fetchone()
+    destination = _destination_from_row(row) if row else None
+    destination_by_id_cache.set(destination_id, destination)
+    return destination
+
+async def get_account_settings_async(user_id: str) -> dict:
+    """
+    The user's account settings ({} if never set).
+    Served from account_settings_cache when possible.
+    """
+    settings = account_settings_cache.get(user_id)
+    if settings is MISSING:
+        settings = await run_db(_load_account_settings, user_id)
+    return settings
+
+def _load_account_settings(user_id: str) -> dict:
+    generation = account_settings_cache.generation(user_id)
+    conn = get_conn()
+    cur = conn.cursor()
+
+    cur.execute("SELECT ingest_response FROM account_settings WHERE user_id = ?", (user_id,))
+    row = cur.fetchone()
+    settings = dict(row) if row else {}
+    account_settings_cache.set(user_id, settings, generation)
+    return settings
+
+def save_account_settings(user_id: str, settings: dict, updated_at: str):
+    conn = get_conn()
+    cur = conn.cursor()
+
+    cur.execute("""
+        INSERT INTO account_settings (user_id, ingest_response, updated_at)
+        VALUES (?, ?, ?)
+        ON CONFLICT (user_id) DO UPDATE SET
+            ingest_response = excluded.ingest_response,
+            updated_at = excluded.updated_at
+    """, (user_id, settings.get("ingest_response"), updated_at))
+
+    conn.commit()
+    account_settings_cache.invalidate(user_id)
+
+async def save_account_settings_async(user_id: str, settings: dict, updated_at: str):
+    await run_db(save_account_settings, user_id, settings, updated_at)
@@ -0,0 +1,66 @@
+import os
+
+from fastjson import dumps
+
+# Envelope versions, chosen per destination ("envelope_version"):
+#   1 - the payload twice, as "data" and "raw" (the original shape)
+#   2 - the payload once, as "data"; half the bytes on the wire
+ENVELOPE_VERSIONS = (1, 2)
+# For destinations that don't pick one (and deliveries whose destination is gone)
+DEFAULT_ENVELOPE_VERSION = int(os.getenv("DEFAULT_ENVELOPE_VERSION", "1"))
+if DEFAULT_ENVELOPE_VERSION not in ENVELOPE_VERSIONS:
+    raise ValueError(
+        f"DEFAULT_ENVELOPE_VERSION must be one of {', '.join(map(str, ENVELOPE_VERSIONS))}, "
+        f"got {DEFAULT_ENVELOPE_VERSION}"
+    )
+
+def envelope_version(destination: dict | None) -> int:
+    if destination:
+        return destination["envelope_version"]
+    return DEFAULT_ENVELOPE_VERSION
+
+def build_event(
+    event_id: str,
+    source: str,
+    event_type: str,
+    occurred_at: str,
+    payload: dict,
+    version: int
+):
+    """
+    The JSON body POSTed to destinations (and echoed back by ingest).
+    """
+    event = {
+        "event_id": event_id,
+        "source": source,
+        "event_type": event_type,
+        "occurred_at": occurred_at,
+        "data": payload
+    }
+    if version == 1:
+        event["raw"] = payload
+    return event
+
+def encode_event(
+    event_id: str,
+    source: str,
+    event_type: str,
+    occurred_at: str,
+    payload_json: bytes,
+    version: int
+) -> bytes:
+    """
+    build_event() already serialized: the same JSON body, with the stored
+    payload bytes spliced in as-is instead of being decoded and re-encoded.
+    """
+    head = dumps({
+        "event_id": event_id,
+        "source": source,
+        "event_type": event_type,
+        "occurred_at": occurred_at
+    })
+    parts = [head[:-1], b',"data":', payload_json]
+    if version == 1:
+        parts += [b',"raw":', payload_json]
+    parts.append(b"}")
+    return b"".join(parts)
@@ -0,0 +1,17 @@
+import json
+
+# orjson is optional: several times faster at encoding, and it produces bytes
+# directly. Without it we fall back to the stdlib with the same compact output.
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+def dumps(obj) -> bytes:
+    """Compact JSON as UTF-8 bytes."""
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj)
+        except TypeError:
+            pass  # e.g. ints beyond 64 bits, which json.loads happily accepts
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False).encode()
@@ -1,80 +1,123 @@
-from fastapi import FastAPI, Body, HTTPException, Request, BackgroundTasks
-from datetime import datetime
-import uuid
-import httpx
+from fastapi import FastAPI, Body, HTTPException, Query, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from datetime import datetime, timezone
+import base64
+import csv
+import io
+import json
+import os
 import time
+import uuid
 
+import worker
+from fastjson import dumps
+from schemas import (
+    DestinationCreated,
+    DestinationList,
+    Delivery,
+    DeliveryDetail,
+    DeliveryList,
+    ReplayAccepted,
+    IngestAccepted,
+    IngestStreamAccepted,
+    DeliveryRef,
+    IngestBatchAccepted,
+    DeliveryStats
+)
+from envelope import build_event, envelope_version, ENVELOPE_VERSIONS, DEFAULT_ENVELOPE_VERSION
 from db import (
     init_db,
-    create_delivery,
-    get_delivery,
-    update_delivery,
-    list_deliveries_for_user,
-    create_destination_db,
-    list_destinations_db,
-    get_active_destination_url
+    close_db,
+    create_delivery_async,
+    create_deliveries_async,
+    start_writer,
+    stop_writer,
+    writer_stats,
+    get_delivery_async,
+    list_deliveries_for_user_async,
+    get_delivery_stats_async,
+    create_destination_db_async,
+    list_destinations_db_async,
+    get_active_destination_async,
+    get_destination_async,
+    get_circuit_state_async,
+    get_account_settings_async,
+    save_account_settings_async,
+    destination_cache,
+    account_settings_cache
 )
 
 app = FastAPI()
 
+# Run the delivery worker pool inside the API process. Set to 0 when running
+# `python worker.py` separately to scale delivery independently of the API.
+DELIVERY_WORKERS_IN_API = os.getenv("DELIVERY_WORKERS_IN_API", "1") == "1"
+
+# Outbound batching (opt-in per destination via "batch" on POST /v1/destinations).
+# Omitted limits take these defaults; max_wait_ms is capped well below the
+# worker's lease so buffered deliveries are never claimed twice.
+DESTINATION_BATCH_DEFAULTS = {"max_items": 100, "max_wait_ms": 1000, "max_bytes": 1024 * 1024}
+DESTINATION_BATCH_MAX_WAIT_MS = 10000
+
+# Per-destination HTTP timeouts ("timeouts" on POST /v1/destinations), in
+# seconds, each phase capped at DESTINATION_TIMEOUT_MAX_SECONDS. The worker
+# also bounds each whole attempt by the row's lease and remaining deadline
+# (worker.attempt_budget); "deadline" covers the delivery, retries included.
+DESTINATION_TIMEOUT_KEYS = ("connect", "read", "write", "pool")
+DESTINATION_TIMEOUT_MAX_SECONDS = 30.0
+
+# What POST /v1/ingest/{source} answers with: "full" echoes the event back,
+# "minimal" is a 202 with just the ids. Chosen per request with
+# `Prefer: return=minimal` / `return=representation`, else by the account's
+# ingest_response setting, else INGEST_RESPONSE_DEFAULT.
+INGEST_RESPONSE_MODES = ("full", "minimal")
+INGEST_RESPONSE_DEFAULT = os.getenv("INGEST_RESPONSE_DEFAULT", "full")
+
+# GET /v1/deliveries page size cap. Full histories go through the streaming
+# GET /v1/deliveries/export, read DELIVERIES_EXPORT_CHUNK_ROWS rows at a time.
+DELIVERIES_PAGE_MAX = int(os.getenv("DELIVERIES_PAGE_MAX", "500"))
+DELIVERIES_EXPORT_CHUNK_ROWS = int(os.getenv("DELIVERIES_EXPORT_CHUNK_ROWS", "1000"))
+DELIVERIES_EXPORT_FORMATS = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+# GET /v1/stats granularities: characters of the hourly bucket ("YYYY-MM-DDTHH")
+# to group by, and the suffix that turns the group into a timestamp label
+STATS_GRANULARITIES = {"hour": (13, ":00:00Z"), "day": (10, "")}
+
+# Max events accepted by one POST /v1/ingest/{source}/batch request
+INGEST_BATCH_MAX_ITEMS = int(os.getenv("INGEST_BATCH_MAX_ITEMS", "1000"))
+# ... and bytes of request body, checked before anything is parsed
+INGEST_BATCH_MAX_BYTES = int(os.getenv("INGEST_BATCH_MAX_BYTES", str(10 * 1024 * 1024)))
+
+# Streaming NDJSON ingest: records are committed every INGEST_STREAM_CHUNK_ITEMS
+# or once INGEST_STREAM_CHUNK_BYTES of them are buffered, whichever comes first,
+# and a single record (line) may not exceed INGEST_STREAM_MAX_LINE_BYTES.
+INGEST_STREAM_CHUNK_ITEMS = int(os.getenv("INGEST_STREAM_CHUNK_ITEMS", "500"))
+INGEST_STREAM_CHUNK_BYTES = int(os.getenv("INGEST_STREAM_CHUNK_BYTES", str(1024 * 1024)))
+INGEST_STREAM_MAX_LINE_BYTES = int(os.getenv("INGEST_STREAM_MAX_LINE_BYTES", str(1024 * 1024)))
+INGEST_STREAM_MAX_ERRORS = 100  # rejected lines reported back, at most
+
 @app.on_event("startup")
-def on_startup():
+async def on_startup():
     init_db()
+    await start_writer()
+    if DELIVERY_WORKERS_IN_API:
+        await worker.start_workers()
 
-# TEMP storage (we still keep user grouping in memory for now, but deliveries are in SQLite)
-# Structure:
-# USERS[user_id] = { "destinations": [...], "events": [...] }
-USERS = {}
-
-async def attempt_delivery(delivery_id: str, destination_url: str, event: dict):
-    max_attempts = 3
-    last_error = None
-
-    async with httpx.AsyncClient(timeout=10.0) as client:
-        for attempt in range(1, max_attempts + 1):
-            try:
-                resp = await client.post(destination_url, json=event)
-
-                # Consider 2xx as success
-                if 200 <= resp.status_code < 300:
-                    update_delivery(
-                        delivery_id=delivery_id,
-                        status="delivered",
-                        attempts=attempt,
-                        last_error=None
-                    )
-                    return resp.status_code
-
-                # Non-2xx = failure worth retrying
-                last_error = f"Non-2xx response: {resp.status_code}"
-                update_delivery(
-                    delivery_id=delivery_id,
-                    status="pending",
-                    attempts=attempt,
-                    last_error=last_error
-                )
+@app.on_event("shutdown")
+async def on_shutdown():
+    if DELIVERY_WORKERS_IN_API:
+        await worker.stop_workers()
+    await stop_writer()
+    close_db()
 
-            except Exception as e:
-                last_error = str(e)
-                update_delivery(
-                    delivery_id=delivery_id,
-                    status="pending",
-                    attempts=attempt,
-                    last_error=last_error
-                )
+DELIVERY_STATUSES = ("pending", "delivered", "failed")
 
-            # Backoff before next attempt (1s, 2s, 4s)
-            time.sleep(2 ** (attempt - 1))
-
-    # If we get here, all attempts failed
-    update_delivery(
-        delivery_id=delivery_id,
-        status="failed",
-        attempts=max_attempts,
-        last_error=last_error
-    )
-    return None
+TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S.%fZ"
 
+def utc_now_iso() -> str:
+    # Fixed width (always with microseconds) so timestamps sort correctly as
+    # strings; delivery listing and its cursors rely on that
+    return datetime.utcnow().strftime(TIMESTAMP_FORMAT)
 
 def get_user_id(request: Request) -> str:
     """
@@ -92,18 +135,25 @@ def get_user_id(request: Request) -> str:
         )
     return user_id
 
-def ensure_user(user_id: str):
-    if user_id not in USERS:
-        USERS[user_id] = {"destinations": [], "events": []}
-
 @app.get("/")
 def read_root():
     return {"message": "Webhook API is running"}
 
-@app.post("/v1/destinations")
+@app.get("/metrics")
+def read_metrics():
+    return {
+        "destination_cache": destination_cache.stats(),
+        "event_body_cache": worker.event_body_cache.stats(),
+        "account_settings_cache": account_settings_cache.stats(),
+        "delivery_recovery": worker.recovery_stats,
+        "delivery_scheduler": worker.scheduler_stats(),
+        "circuit_breakers": worker.breaker_stats(),
+        "db_writer": writer_stats,
+    }
+
+@app.post("/v1/destinations", response_model=DestinationCreated)
 async def create_destination(request: Request, payload: dict = Body(...)):
     user_id = get_user_id(request)
-    ensure_user(user_id)
 
     url = payload.get("url")
     if not url:
@@ -113,11 +163,32 @@ async def create_destination(request: Request, payload: dict = Body(...)):
     if not (url.startswith("http://") or url.startswith("https://")):
         url = "https://" + url
 
+    batch = parse_batch_settings(payload.get("batch"))
+
+    max_in_flight = payload.get("max_in_flight")
+    if max_in_flight is not None and (
+        isinstance(max_in_flight, bool) or not isinstance(max_in_flight, int) or max_in_flight < 1
+    ):
+        raise HTTPException(status_code=400, detail="'max_in_flight' must be a positive integer")
+
+    timeouts = parse_timeout_settings(payload.get("timeouts"))
+
+    version = payload.get("envelope_version", DEFAULT_ENVELOPE_VERSION)
+    if isinstance(version, bool) or version not in ENVELOPE_VERSIONS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"'envelope_version' must be one of {', '.join(map(str, ENVELOPE_VERSIONS))}"
+        )
+
     destination = {
         "destination_id": f"dst_{uuid.uuid4().hex}",
         "url": url,
         "active": True,
-        "created_at": datetime.utcnow().isoformat() + "Z"
+        "created_at": utc_now_iso(),
+        "batch": batch,
+        "max_in_flight": max_in_flight,
+        "timeouts": timeouts,
+        "envelope_version": version
     }
 
     db_destination = {
@@ -125,9 +196,19 @@ async def create_destination(request: Request, payload: dict = Body(...)):
         "user_id": user_id,
         "url": destination["url"],
         "active": destination["active"],
-        "created_at": destination["created_at"]
+        "created_at": destination["created_at"],
+        "batch_max_items": batch["max_items"] if batch else None,
+        "batch_max_wait_ms": batch["max_wait_ms"] if batch else None,
+        "batch_max_bytes": batch["max_bytes"] if batch else None,
+        "max_in_flight": max_in_flight,
+        "timeout_connect": timeouts["connect"],
+        "timeout_read": timeouts["read"],
+        "timeout_write": timeouts["write"],
+        "timeout_pool": timeouts["pool"],
+        "deadline_seconds": timeouts["deadline"],
+        "envelope_version": version
     }
-    create_destination_db(db_destination)
+    await create_destination_db_async(db_destination)
 
     return {
         "status": "created",
@@ -135,11 +216,82 @@ async def create_destination(request: Request, payload: dict = Body(...)):
         "destination": destination
     }
 
-@app.get("/v1/destinations")
+def parse_batch_settings(value):
+    """
+    Validate the optional "batch" object of POST /v1/destinations:
+    {"max_items": int, "max_wait_ms": int, "max_bytes": int}, or true for
+    the defaults. Returns None when batching is off.
+    """
+    if value is None or value is False:
+        return None
+    if value is True:
+        value = {}
+    if not isinstance(value, dict):
+        raise HTTPException(status_code=400, detail="'batch' must be an object")
+
+    settings = {}
+    for key, default in DESTINATION_BATCH_DEFAULTS.items():
+        v = value.get(key, default)
+        if isinstance(v, bool) or not isinstance(v, int) or v < 1:
+            raise HTTPException(status_code=400, detail=f"'batch.{key}' must be a positive integer")
+        settings[key] = v
+
+    if settings["max_wait_ms"] > DESTINATION_BATCH_MAX_WAIT_MS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"'batch.max_wait_ms' must be at most {DESTINATION_BATCH_MAX_WAIT_MS}"
+        )
+    return settings
+
+def destination_batch(d: dict):
+    if not d.get("batch_max_items"):
+        return None
+    return {
+        "max_items": d["batch_max_items"],
+        "max_wait_ms": d["batch_max_wait_ms"],
+        "max_bytes": d["batch_max_bytes"]
+    }
+
+def parse_timeout_settings(value):
+    """
+    Validate the optional "timeouts" object of POST /v1/destinations:
+    {"connect", "read", "write", "pool", "deadline"}, all in seconds.
+    Omitted keys come back as None (worker default / no deadline).
+    """
+    if value is None:
+        value = {}
+    if not isinstance(value, dict):
+        raise HTTPException(status_code=400, detail="'timeouts' must be an object")
+
+    settings = {}
+    for key in (*DESTINATION_TIMEOUT_KEYS, "deadline"):
+        v = value.get(key)
+        if v is not None and (isinstance(v, bool) or not isinstance(v, (int, float)) or v <= 0):
+            raise HTTPException(status_code=400, detail=f"'timeouts.{key}' must be a positive number")
+        if v is not None and key != "deadline" and v > DESTINATION_TIMEOUT_MAX_SECONDS:
+            raise HTTPException(
+                status_code=400,
+                detail=f"'timeouts.{key}' must be at most {DESTINATION_TIMEOUT_MAX_SECONDS:g}"
+            )
+        settings[key] = float(v) if v is not None else None
+    return settings
+
+def destination_timeouts(d: dict):
+    return {
+        **{key: d[f"timeout_{key}"] for key in DESTINATION_TIMEOUT_KEYS},
+        "deadline": d["deadline_seconds"]
+    }
+
+def delivery_deadline(destination: dict | None):
+    """Unix time after which a delivery queued now is given up, or None."""
+    if destination and destination["deadline_seconds"]:
+        return time.time() + destination["deadline_seconds"]
+    return None
+
+@app.get("/v1/destinations", response_model=DestinationList)
 async def list_destinations(request: Request):
     user_id = get_user_id(request)
-    ensure_user(user_id)
-    destinations = list_destinations_db(user_id)
+    destinations = await list_destinations_db_async(user_id)
     # keep the response shape similar to before
     return {
         "user_id": user_id,
@@ -148,18 +300,148 @@ async def list_destinations(request: Request):
                 "destination_id": d["id"],
                 "url": d["url"],
                 "active": d["active"],
-                "created_at": d["created_at"]
+                "created_at": d["created_at"],
+                "batch": destination_batch(d),
+                "max_in_flight": d["max_in_flight"],
+                "timeouts": destination_timeouts(d),
+                "envelope_version": envelope_version(d)
             }
             for d in destinations
         ]
     }
 
-@app.get("/v1/deliveries/{delivery_id}")
+@app.get("/v1/destinations/{destination_id}/circuit")
+async def read_destination_circuit(request: Request, destination_id: str):
+    """
+    Circuit breaker state for a destination, as last recorded by the delivery
+    worker. A destination that has never tripped is reported as closed.
+    """
+    user_id = get_user_id(request)
+
+    destination = await get_destination_async(destination_id)
+    if not destination:
+        raise HTTPException(status_code=404, detail="Destination not found")
+
+    if destination["user_id"] != user_id:
+        raise HTTPException(status_code=403, detail="Forbidden")
+
+    circuit = await get_circuit_state_async(destination["url"])
+    if circuit is None:
+        circuit = {"state": "closed", "failure_rate": 0.0, "open_until": None, "trips": 0, "updated_at": None}
+    else:
+        circuit.pop("destination_url")
+
+    return {
+        "destination_id": destination_id,
+        "url": destination["url"],
+        "circuit": circuit
+    }
+
+@app.get("/v1/account/settings")
+async def read_account_settings(request: Request):
+    user_id = get_user_id(request)
+    settings = await get_account_settings_async(user_id)
+    return {
+        "user_id": user_id,
+        "settings": {"ingest_response": settings.get("ingest_response") or INGEST_RESPONSE_DEFAULT}
+    }
+
+@app.put("/v1/account/settings")
+async def update_account_settings(request: Request, payload: dict = Body(...)):
+    """
+    Replace the account's settings. Omitted (or null) keys go back to the
+    default. Currently just "ingest_response": "full" or "minimal".
+    """
+    user_id = get_user_id(request)
+
+    ingest_response = payload.get("ingest_response")
+    if ingest_response is not None and ingest_response not in INGEST_RESPONSE_MODES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"'ingest_response' must be one of {', '.join(INGEST_RESPONSE_MODES)}"
+        )
+
+    await save_account_settings_async(
+        user_id,
+        {"ingest_response": ingest_response},
+        utc_now_iso()
+    )
+    return {
+        "status": "updated",
+        "user_id": user_id,
+        "settings": {"ingest_response": ingest_response or INGEST_RESPONSE_DEFAULT}
+    }
+
+@app.get(
+    "/v1/deliveries/export",
+    response_class=StreamingResponse,
+    responses={200: {"content": {media_type: {} for media_type in DELIVERIES_EXPORT_FORMATS.values()}}},
+)
+async def export_deliveries(
+    request: Request,
+    format: str = "ndjson",
+    status: str | None = None,
+    source: str | None = None,
+    event_type: str | None = None,
+    since: str | None = None,
+    until: str | None = None
+):
+    """
+    Every delivery matching the filters (same as GET /v1/deliveries), newest
+    first, streamed as NDJSON or CSV. Rows are read by keyset in chunks, so
+    memory stays constant however long the history is. Each chunk is its own
+    read, so rows written during a long export may or may not be included.
+    """
+    user_id = get_user_id(request)
+
+    if format not in DELIVERIES_EXPORT_FORMATS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"'format' must be one of {', '.join(DELIVERIES_EXPORT_FORMATS)}"
+        )
+    filters = delivery_filters(status, source, event_type, since, until)
+
+    return StreamingResponse(
+        stream_deliveries_export(user_id, format, filters),
+        media_type=DELIVERIES_EXPORT_FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="deliveries.{format}"'}
+    )
+
+async def stream_deliveries_export(user_id: str, format: str, filters: dict):
+    fields = list(Delivery.model_fields)
+    if format == "csv":
+        yield csv_rows([fields])
+
+    after = None
+    while True:
+        deliveries = await list_deliveries_for_user_async(
+            user_id,
+            limit=DELIVERIES_EXPORT_CHUNK_ROWS,
+            after=after,
+            **filters
+        )
+        if not deliveries:
+            return
+
+        if format == "csv":
+            yield csv_rows([d[f] for f in fields] for d in deliveries)
+        else:
+            yield b"".join(dumps({f: d[f] for f in fields}) + b"\n" for d in deliveries)
+
+        if len(deliveries) < DELIVERIES_EXPORT_CHUNK_ROWS:
+            return
+        after = (deliveries[-1]["occurred_at"], deliveries[-1]["id"])
+
+def csv_rows(rows) -> bytes:
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(rows)
+    return buffer.getvalue().encode()
+
+@app.get("/v1/deliveries/{delivery_id}", response_model=DeliveryDetail)
 async def read_delivery_status(request: Request, delivery_id: str):
     user_id = get_user_id(request)
-    ensure_user(user_id)
 
-    delivery = get_delivery(delivery_id)
+    delivery = await get_delivery_async(delivery_id)
     if not delivery:
         raise HTTPException(status_code=404, detail="Delivery not found")
 
@@ -168,76 +450,453 @@ async def read_delivery_status(request: Request, delivery_id: str):
 
     return {"delivery": delivery}
 
-@app.get("/v1/deliveries")
-async def list_deliveries(request: Request, limit: int = 20):
+@app.post("/v1/deliveries/{delivery_id}/replay", response_model=ReplayAccepted)
+async def replay_delivery(request: Request, delivery_id: str):
     user_id = get_user_id(request)
-    ensure_user(user_id)
 
-    deliveries = list_deliveries_for_user(user_id, limit=limit)
-    return {"user_id": user_id, "deliveries": deliveries}
+    original = await get_delivery_async(delivery_id)
+    if not original:
+        raise HTTPException(status_code=404, detail="Delivery not found")
+
+    if original["user_id"] != user_id:
+        raise HTTPException(status_code=403, detail="Forbidden")
+
+    if not original["event_id"]:
+        raise HTTPException(status_code=409, detail="Event payload not stored for this delivery")
+
+    # The deadline restarts with the replay, from the destination's current setting
+    destination = (
+        await get_destination_async(original["destination_id"]) if original["destination_id"] else None
+    )
 
+    # New delivery for the same stored event, so the original keeps its history
+    replay_id = f"dly_{uuid.uuid4().hex}"
+    delivery = {
+        "id": replay_id,
+        "user_id": user_id,
+        "source": original["source"],
+        "destination_url": original["destination_url"],
+        "event_type": original["event_type"],
+        "occurred_at": original["occurred_at"],
+        "status": "pending",
+        "attempts": 0,
+        "last_error": None,
+        "event_id": original["event_id"],
+        "next_attempt_at": time.time(),
+        "destination_id": original["destination_id"],
+        "deadline_at": delivery_deadline(destination)
+    }
+    await create_delivery_async(delivery)
+    worker.notify()
 
-@app.post("/v1/ingest/{source}")
-async def ingest_webhook(
-    source: str,
+    return {
+        "status": "accepted",
+        "delivery_id": replay_id,
+        "replay_of": delivery_id,
+        "user_id": user_id
+    }
+
+@app.get("/v1/deliveries", response_model=DeliveryList)
+async def list_deliveries(
     request: Request,
-    background_tasks: BackgroundTasks,
-    payload: dict = Body(...)
+    limit: int = Query(20, ge=1, le=DELIVERIES_PAGE_MAX),
+    cursor: str | None = None,
+    status: str | None = None,
+    source: str | None = None,
+    event_type: str | None = None,
+    since: str | None = None,
+    until: str | None = None
 ):
-
+    """
+    Newest first. Pass the returned next_cursor back as `cursor` for the
+    next page (with the same filters); it is null on the last page.
+    since/until are ISO 8601 timestamps bounding occurred_at.
+    For a full dump use GET /v1/deliveries/export.
+    """
     user_id = get_user_id(request)
-    ensure_user(user_id)
+    filters = delivery_filters(status, source, event_type, since, until)
+
+    # One extra row tells us whether there is a next page
+    deliveries = await list_deliveries_for_user_async(
+        user_id,
+        limit=limit + 1,
+        after=decode_cursor(cursor) if cursor else None,
+        **filters
+    )
 
-    destination_url = get_active_destination_url(user_id)
+    next_cursor = None
+    if len(deliveries) > limit:
+        deliveries = deliveries[:limit]
+        next_cursor = encode_cursor(deliveries[-1])
 
-    if not destination_url:
+    return {"user_id": user_id, "deliveries": deliveries, "next_cursor": next_cursor}
+
+def delivery_filters(status, source, event_type, since, until) -> dict:
+    """Validated filter keyword arguments for list_deliveries_for_user."""
+    if status is not None and status not in DELIVERY_STATUSES:
         raise HTTPException(
             status_code=400,
-            detail="No active destination configured for this user. Create one using POST /v1/destinations"
+            detail=f"'status' must be one of {', '.join(DELIVERY_STATUSES)}"
         )
+    return {
+        "status": status,
+        "source": source,
+        "event_type": event_type,
+        "since": parse_timestamp("since", since),
+        "until": parse_timestamp("until", until)
+    }
 
+@app.get("/v1/stats", response_model=DeliveryStats)
+async def read_delivery_stats(
+    request: Request,
+    granularity: str = "hour",
+    since: str | None = None,
+    until: str | None = None,
+    source: str | None = None,
+    event_type: str | None = None
+):
+    """
+    Delivery counts by status per time bucket, source and event_type, read
+    from the delivery_stats rollup. Buckets go by occurred_at; since/until
+    (ISO 8601) are rounded down to the hour.
+    """
+    user_id = get_user_id(request)
 
-    event = {
-        "event_id": f"evt_{uuid.uuid4().hex}",
-        "source": source,
-        "event_type": payload.get("event", "unknown"),
-        "occurred_at": datetime.utcnow().isoformat() + "Z",
-        "data": payload,
-        "raw": payload
+    if granularity not in STATS_GRANULARITIES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"'granularity' must be one of {', '.join(STATS_GRANULARITIES)}"
+        )
+    bucket_chars, label_suffix = STATS_GRANULARITIES[granularity]
+
+    rows = await get_delivery_stats_async(
+        user_id,
+        bucket_chars=bucket_chars,
+        since=parse_timestamp("since", since),
+        until=parse_timestamp("until", until),
+        source=source,
+        event_type=event_type
+    )
+
+    buckets = {}
+    totals = {"total": 0}
+    for r in rows:
+        key = (r["period"], r["source"], r["event_type"])
+        bucket = buckets.get(key)
+        if bucket is None:
+            bucket = buckets[key] = {
+                "bucket": r["period"] + label_suffix,
+                "source": r["source"],
+                "event_type": r["event_type"],
+                "total": 0
+            }
+        bucket[r["status"]] = bucket.get(r["status"], 0) + r["count"]
+        bucket["total"] += r["count"]
+        totals[r["status"]] = totals.get(r["status"], 0) + r["count"]
+        totals["total"] += r["count"]
+
+    return {
+        "user_id": user_id,
+        "granularity": granularity,
+        "buckets": list(buckets.values()),
+        "totals": totals
     }
 
-    # Save event (per user, in-memory)
-    USERS[user_id]["events"].append(event)
+def encode_cursor(delivery: dict) -> str:
+    """Opaque page cursor: the (occurred_at, id) position of a delivery."""
+    raw = json.dumps([delivery["occurred_at"], delivery["id"]], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> tuple[str, str]:
+    try:
+        position = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except ValueError:
+        position = None
+    if not (
+        isinstance(position, list) and len(position) == 2
+        and all(isinstance(v, str) for v in position)
+    ):
+        raise HTTPException(status_code=400, detail="Invalid 'cursor'")
+    return position[0], position[1]
+
+def parse_timestamp(name: str, value: str | None) -> str | None:
+    """An ISO 8601 query parameter in the stored occurred_at format (UTC)."""
+    if value is None:
+        return None
+    try:
+        dt = datetime.fromisoformat(value)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"'{name}' must be an ISO 8601 timestamp")
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc).replace(tzinfo=None)
+    return dt.strftime(TIMESTAMP_FORMAT)
+
+
+def new_delivery(user_id: str, source: str, destination: dict, payload: dict):
+    """
+    Build the event envelope and its pending delivery row for one payload.
+    The row plus the stored payload (events table, the only copy we keep)
+    is the durable queue entry; the worker pool picks it up from there.
+    """
+    event = build_event(
+        event_id=f"evt_{uuid.uuid4().hex}",
+        source=source,
+        event_type=event_type_of(payload),
+        occurred_at=utc_now_iso(),
+        payload=payload,
+        version=envelope_version(destination)
+    )
 
-    # Create delivery record (SQLite)
-    delivery_id = f"dly_{uuid.uuid4().hex}"
     delivery = {
-        "id": delivery_id,
+        "id": f"dly_{uuid.uuid4().hex}",
         "user_id": user_id,
         "source": source,
-        "destination_url": destination_url,
+        "destination_url": destination["url"],
         "event_type": event["event_type"],
         "occurred_at": event["occurred_at"],
         "status": "pending",
         "attempts": 0,
-        "last_error": None
+        "last_error": None,
+        "event_id": event["event_id"],
+        "next_attempt_at": time.time(),
+        "destination_id": destination["id"],
+        "deadline_at": delivery_deadline(destination)
     }
-    create_delivery(delivery)
+    return event, delivery
 
-    # Forward once (retries coming next)
-   # Run delivery + retries in the background (do not block the response)
-    background_tasks.add_task(attempt_delivery, delivery_id, destination_url, event)
-    destination_status = None
+def event_type_of(payload: dict) -> str:
+    # "event" is whatever the producer sent; keep non-strings as their JSON text
+    event_type = payload.get("event")
+    if event_type is None:
+        return "unknown"
+    if isinstance(event_type, str):
+        return event_type
+    return json.dumps(event_type, separators=(",", ":"))
 
+async def require_destination(user_id: str) -> dict:
+    destination = await get_active_destination_async(user_id)
 
+    if not destination:
+        raise HTTPException(
+            status_code=400,
+            detail="No active destination configured for this user. Create one using POST /v1/destinations"
+        )
+    return destination
+
+async def ingest_response_mode(user_id: str, request: Request) -> str:
+    """"full" or "minimal": the Prefer header wins over the account setting."""
+    for preference in request.headers.get("prefer", "").split(","):
+        preference = preference.strip().lower().replace(" ", "")
+        if preference == "return=minimal":
+            return "minimal"
+        if preference == "return=representation":
+            return "full"
+
+    settings = await get_account_settings_async(user_id)
+    return settings.get("ingest_response") or INGEST_RESPONSE_DEFAULT
+
+def is_ndjson(request: Request) -> bool:
+    return request.headers.get("content-type", "").startswith("application/x-ndjson")
+
+@app.post(
+    "/v1/ingest/{source}",
+    openapi_extra={
+        "requestBody": {
+            "required": True,
+            "content": {
+                "application/json": {"schema": {"type": "object"}},
+                "application/x-ndjson": {"schema": {"type": "string"}},
+            },
+        }
+    },
+    response_model=IngestAccepted | IngestStreamAccepted,
+    # Envelope version 2 events have no "raw"; don't emit it as null
+    response_model_exclude_unset=True,
+    responses={
+        202: {
+            "model": DeliveryRef,
+            "description": "Accepted; minimal acknowledgement (Prefer: return=minimal)"
+        }
+    },
+)
+async def ingest_webhook(source: str, request: Request):
+    """
+    Ingest one event (JSON object), or stream many as NDJSON with
+    Content-Type: application/x-ndjson (see ingest_ndjson_stream).
+    With `Prefer: return=minimal` (or the account default) a single event
+    is acknowledged with a 202 and its ids instead of being echoed back.
+    """
+    user_id = get_user_id(request)
+    destination = await require_destination(user_id)
+    destination_url = destination["url"]
 
+    if is_ndjson(request):
+        return await ingest_ndjson_stream(user_id, source, destination, request)
+
+    try:
+        payload = await request.json()
+    except ValueError:
+        raise HTTPException(status_code=422, detail="Request body is not valid JSON")
+    if not isinstance(payload, dict):
+        raise HTTPException(status_code=422, detail="Request body must be a JSON object")
+
+    # Create delivery record (SQLite)
+    event, delivery = new_delivery(user_id, source, destination, payload)
+    await create_delivery_async(delivery, payload)
+    worker.notify()
+    destination_status = None
+
+    if await ingest_response_mode(user_id, request) == "minimal":
+        return JSONResponse(
+            status_code=202,
+            content={"delivery_id": delivery["id"], "event_id": delivery["event_id"]},
+            headers={"Preference-Applied": "return=minimal"}
+        )
 
     return {
         "status": "accepted",
-        "delivery_id": delivery_id,
+        "delivery_id": delivery["id"],
         "user_id": user_id,
         "destination_url": destination_url,
         "destination_status": destination_status,
         "event": event
     }
 
+async def ingest_ndjson_stream(user_id: str, source: str, destination: dict, request: Request):
+    """
+    Parse the body line by line as it arrives and commit deliveries every
+    INGEST_STREAM_CHUNK_ITEMS records or INGEST_STREAM_CHUNK_BYTES of them,
+    so memory stays bounded by one chunk no matter how large the upload or
+    its records are. Lines that aren't JSON
+    objects are skipped and reported; accepted records stay accepted.
+    """
+    accepted = 0
+    rejected = 0
+    errors = []
+    deliveries = []
+    payloads = []
+    buffered_bytes = 0  # raw size of the records in `payloads`
+    line_no = 0
+
+    async def flush():
+        nonlocal accepted, buffered_bytes
+        if not deliveries:
+            return
+        await create_deliveries_async(deliveries, payloads)
+        worker.notify()
+        accepted += len(deliveries)
+        deliveries.clear()
+        payloads.clear()
+        buffered_bytes = 0
+
+    async def handle_line(line: bytes):
+        nonlocal rejected, line_no, buffered_bytes
+        line_no += 1
+        if not line.strip():
+            return
+        try:
+            payload = json.loads(line)
+        except ValueError:
+            payload = None
+        if not isinstance(payload, dict):
+            rejected += 1
+            if len(errors) < INGEST_STREAM_MAX_ERRORS:
+                errors.append({"line": line_no, "error": "Not a JSON object"})
+            return
+        deliveries.append(new_delivery(user_id, source, destination, payload)[1])
+        payloads.append(payload)
+        buffered_bytes += len(line)
+        if len(deliveries) >= INGEST_STREAM_CHUNK_ITEMS or buffered_bytes >= INGEST_STREAM_CHUNK_BYTES:
+            await flush()
+
+    buffer = b""
+    async for chunk in request.stream():
+        lines = (buffer + chunk).split(b"\n")
+        buffer = lines.pop()
+        for line in lines:
+            await handle_line(line)
+        if len(buffer) > INGEST_STREAM_MAX_LINE_BYTES:
+            await flush()
+            raise HTTPException(
+                status_code=413,
+                detail=(
+                    f"Line {line_no + 1} exceeds {INGEST_STREAM_MAX_LINE_BYTES} bytes; "
+                    f"{accepted} events before it were accepted"
+                )
+            )
+    await handle_line(buffer)
+    await flush()
+
+    return {
+        "status": "accepted",
+        "user_id": user_id,
+        "destination_url": destination["url"],
+        "accepted": accepted,
+        "rejected": rejected,
+        "errors": errors
+    }
+
+@app.post("/v1/ingest/{source}/batch", response_model=IngestBatchAccepted)
+async def ingest_webhook_batch(source: str, request: Request):
+    """
+    Ingest many events in one request: a JSON array of objects, or NDJSON
+    (one object per line) with Content-Type: application/x-ndjson.
+    The destination is resolved once and all deliveries commit together.
+    """
+    user_id = get_user_id(request)
+    destination = await require_destination(user_id)
+    destination_url = destination["url"]
+
+    too_large = HTTPException(
+        status_code=413,
+        detail=f"Request body exceeds {INGEST_BATCH_MAX_BYTES} bytes"
+    )
+    try:
+        declared_length = int(request.headers.get("content-length", "0"))
+    except ValueError:
+        declared_length = 0
+    if declared_length > INGEST_BATCH_MAX_BYTES:
+        raise too_large
+
+    # Content-Length may be absent (chunked) or wrong, so count while reading too
+    body = bytearray()
+    async for chunk in request.stream():
+        body += chunk
+        if len(body) > INGEST_BATCH_MAX_BYTES:
+            raise too_large
+
+    try:
+        if is_ndjson(request):
+            payloads = [json.loads(line) for line in body.splitlines() if line.strip()]
+        else:
+            payloads = json.loads(body)
+    except ValueError:
+        raise HTTPException(status_code=422, detail="Request body is not valid JSON / NDJSON")
+
+    if not isinstance(payloads, list) or not payloads:
+        raise HTTPException(status_code=422, detail="Expected a non-empty array of events")
+
+    if len(payloads) > INGEST_BATCH_MAX_ITEMS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Too many events in one batch (max {INGEST_BATCH_MAX_ITEMS})"
+        )
+
+    for index, payload in enumerate(payloads):
+        if not isinstance(payload, dict):
+            raise HTTPException(status_code=422, detail=f"Event at index {index} is not a JSON object")
+
+    deliveries = [new_delivery(user_id, source, destination, p)[1] for p in payloads]
+    await create_deliveries_async(deliveries, payloads)
+    worker.notify()
+
+    return {
+        "status": "accepted",
+        "user_id": user_id,
+        "destination_url": destination_url,
+        "count": len(deliveries),
+        "deliveries": [
+            {"delivery_id": d["id"], "event_id": d["event_id"]}
+            for d in deliveries
+        ]
+    }
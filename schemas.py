@@ -0,0 +1,127 @@
+"""
+Response models for the API. FastAPI validates handler results against these
+and serializes them straight to JSON bytes with pydantic-core, instead of
+walking every dict through jsonable_encoder.
+"""
+from typing import Any
+
+from pydantic import BaseModel
+
+class BatchSettings(BaseModel):
+    max_items: int
+    max_wait_ms: int
+    max_bytes: int
+
+class TimeoutSettings(BaseModel):
+    connect: float | None
+    read: float | None
+    write: float | None
+    pool: float | None
+    deadline: float | None
+
+class Destination(BaseModel):
+    destination_id: str
+    url: str
+    active: bool
+    created_at: str
+    batch: BatchSettings | None
+    max_in_flight: int | None
+    timeouts: TimeoutSettings
+    envelope_version: int
+
+class DestinationCreated(BaseModel):
+    status: str
+    user_id: str
+    destination: Destination
+
+class DestinationList(BaseModel):
+    user_id: str
+    destinations: list[Destination]
+
+class Delivery(BaseModel):
+    id: str
+    user_id: str
+    source: str
+    destination_url: str
+    event_type: str
+    occurred_at: str
+    status: str
+    attempts: int
+    last_error: str | None
+    event_id: str | None
+    destination_id: str | None
+    deadline_at: float | None
+
+class DeliveryDetail(BaseModel):
+    delivery: Delivery
+
+class DeliveryList(BaseModel):
+    user_id: str
+    deliveries: list[Delivery]
+    next_cursor: str | None
+
+class ReplayAccepted(BaseModel):
+    status: str
+    delivery_id: str
+    replay_of: str
+    user_id: str
+
+class Event(BaseModel):
+    event_id: str
+    source: str
+    event_type: str
+    occurred_at: str
+    data: dict[str, Any]
+    raw: dict[str, Any] | None = None  # envelope version 1 only
+
+class IngestAccepted(BaseModel):
+    status: str
+    delivery_id: str
+    user_id: str
+    destination_url: str
+    destination_status: str | None
+    event: Event
+
+class IngestError(BaseModel):
+    line: int
+    error: str
+
+class IngestStreamAccepted(BaseModel):
+    status: str
+    user_id: str
+    destination_url: str
+    accepted: int
+    rejected: int
+    errors: list[IngestError]
+
+class DeliveryRef(BaseModel):
+    delivery_id: str
+    event_id: str
+
+class IngestBatchAccepted(BaseModel):
+    status: str
+    user_id: str
+    destination_url: str
+    count: int
+    deliveries: list[DeliveryRef]
+
+class StatusCounts(BaseModel):
+    pending: int = 0
+    delivered: int = 0
+    failed: int = 0
+    total: int = 0
+
+class StatsBucket(BaseModel):
+    bucket: str
+    source: str
+    event_type: str
+    pending: int = 0
+    delivered: int = 0
+    failed: int = 0
+    total: int = 0
+
+class DeliveryStats(BaseModel):
+    user_id: str
+    granularity: str
+    buckets: list[StatsBucket]
+    totals: StatusCounts
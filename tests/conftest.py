@@ -0,0 +1,21 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+# The app is a set of top-level modules (db.py, main.py, ...), not a package
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import db  # noqa: E402
+
+@pytest.fixture
+def temp_db(tmp_path, monkeypatch):
+    """A fresh, initialized database file; the caches are emptied afterwards."""
+    monkeypatch.setattr(db, "DB_PATH", tmp_path / "test.db")
+    db.close_db()
+    db.init_db()
+    yield tmp_path / "test.db"
+    db.close_db()
+    db.destination_cache.clear()
+    db.destination_by_id_cache.clear()
+    db.account_settings_cache.clear()
@@ -0,0 +1,136 @@
+"""
+CircuitBreaker state machine: closed -> open -> half-open -> closed/open,
+on a fake clock.
+"""
+import pytest
+
+import breaker
+import worker
+from breaker import CircuitBreaker, CLOSED, OPEN, HALF_OPEN
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def time(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(breaker, "time", clock)
+    monkeypatch.setattr(breaker, "BREAKER_WINDOW", 10)
+    monkeypatch.setattr(breaker, "BREAKER_MIN_REQUESTS", 4)
+    monkeypatch.setattr(breaker, "BREAKER_FAILURE_RATE", 0.5)
+    monkeypatch.setattr(breaker, "BREAKER_OPEN_SECONDS", 30.0)
+    monkeypatch.setattr(breaker, "BREAKER_HALF_OPEN_PROBES", 2)
+    monkeypatch.setattr(breaker, "BREAKER_IDLE_SECONDS", 300.0)
+    return clock
+
+def attempt(b: CircuitBreaker, success: bool):
+    assert b.allow()
+    b.record(success, b.is_probing())
+
+def tripped() -> CircuitBreaker:
+    b = CircuitBreaker()
+    for _ in range(4):
+        attempt(b, False)
+    assert b.state == OPEN
+    return b
+
+def test_opens_once_failure_rate_reached_after_min_requests(clock):
+    b = CircuitBreaker()
+    for _ in range(3):
+        attempt(b, False)
+    assert b.state == CLOSED  # below BREAKER_MIN_REQUESTS
+
+    attempt(b, False)
+    assert b.state == OPEN
+    assert b.trips == 1
+    assert b.is_open() and not b.allow()
+    assert b.retry_at() == clock.now + 30.0
+
+def test_stays_closed_below_failure_rate(clock):
+    b = CircuitBreaker()
+    for success in (True, True, True, False, True, False):
+        attempt(b, success)
+    assert b.state == CLOSED
+
+def test_half_open_lets_only_the_probes_through(clock):
+    b = tripped()
+    clock.now += 30.0
+
+    assert b.allow() and b.is_probing()
+    assert b.allow()
+    assert not b.allow()  # BREAKER_HALF_OPEN_PROBES = 2 already out
+    assert b.state == HALF_OPEN
+    assert b.retry_at() == clock.now + breaker.BREAKER_PROBE_WAIT_SECONDS
+
+def test_probe_success_closes_and_clears_window(clock):
+    b = tripped()
+    clock.now += 30.0
+
+    attempt(b, True)
+    assert b.state == CLOSED
+    assert b.failure_rate() == 0.0
+
+def test_probe_failure_reopens(clock):
+    b = tripped()
+    clock.now += 30.0
+
+    attempt(b, False)
+    assert b.state == OPEN
+    assert b.trips == 2
+    assert b.open_until == clock.now + 30.0
+
+def test_attempt_from_before_the_trip_is_not_a_probe(clock):
+    b = CircuitBreaker()
+    assert b.allow()
+    slow_probe = b.is_probing()  # an attempt that outlives the trip below
+    assert not slow_probe
+    for _ in range(4):
+        attempt(b, False)
+    clock.now += 30.0
+    assert b.allow() and b.is_probing()  # the real probe is now out
+
+    b.record(True, slow_probe)
+    assert b.state == HALF_OPEN  # didn't close on a non-probe's success
+    assert b.probes == 1  # and didn't free the real probe's slot
+
+    b.record(False, slow_probe)
+    assert b.state == HALF_OPEN and b.trips == 1
+
+def test_result_while_open_is_ignored(clock):
+    b = tripped()
+    b.record(True)
+    assert b.state == OPEN
+    assert b.failure_rate() == 1.0
+
+def test_idle_only_when_closed_and_unused(clock):
+    b = CircuitBreaker()
+    attempt(b, True)
+    clock.now += 299.0
+    assert not b.is_idle(clock.now)
+    clock.now += 1.0
+    assert b.is_idle(clock.now)
+
+    b = tripped()
+    clock.now += 1000.0
+    assert not b.is_idle(clock.now)  # open breakers are kept
+
+def test_worker_drops_idle_closed_breakers(clock, monkeypatch):
+    monkeypatch.setattr(worker, "BREAKER_IDLE_SECONDS", 300.0)
+    monkeypatch.setattr(worker, "breakers", {})
+    monkeypatch.setattr(worker, "_breakers_swept_at", clock.now)
+    monkeypatch.setattr(worker, "time", clock)
+
+    attempt(worker.get_breaker("https://idle.example.com"), True)
+    failing = worker.get_breaker("https://down.example.com")
+    for _ in range(4):
+        attempt(failing, False)
+    clock.now += 300.0
+    attempt(worker.get_breaker("https://busy.example.com"), True)
+
+    worker._drop_idle_breakers()
+
+    assert set(worker.breakers) == {"https://down.example.com", "https://busy.example.com"}
@@ -0,0 +1,84 @@
+"""
+TTLCache generations: a value loaded before an invalidate() must not be
+cached after it.
+"""
+import db
+from cache import TTLCache, MISSING
+
+def test_set_with_stale_generation_is_dropped():
+    cache = TTLCache(maxsize=10, ttl=60)
+    generation = cache.generation("u1")
+    cache.invalidate("u1")
+    cache.set("u1", "stale", generation)
+    assert cache.get("u1") is MISSING
+
+    cache.set("u1", "fresh", cache.generation("u1"))
+    assert cache.get("u1") == "fresh"
+
+def test_pruned_generation_still_detects_invalidation():
+    cache = TTLCache(maxsize=2, ttl=60)
+    generation = cache.generation("u1")
+    cache.invalidate("u1")
+    cache.invalidate("u2")
+    cache.invalidate("u3")  # prunes u1's generation
+    cache.set("u1", "stale", generation)
+    assert cache.get("u1") is MISSING
+
+def _destination(destination_id, url, created_at):
+    return {
+        "id": destination_id,
+        "user_id": "u1",
+        "url": url,
+        "active": True,
+        "created_at": created_at,
+        "envelope_version": 1,
+    }
+
+def test_destination_created_during_load_is_not_hidden(temp_db, monkeypatch):
+    db.create_destination_db(_destination("d1", "https://old.example.com", "2024-01-01T00:00:00Z"))
+    original_set = db.destination_cache.set
+
+    def set_after_concurrent_create(key, value, generation=None):
+        # Another request creates a destination after our SELECT ran
+        db.create_destination_db(_destination("d2", "https://new.example.com", "2024-01-02T00:00:00Z"))
+        original_set(key, value, generation)
+
+    with monkeypatch.context() as m:
+        m.setattr(db.destination_cache, "set", set_after_concurrent_create)
+        assert db._load_active_destination("u1")["url"] == "https://old.example.com"
+
+    assert db.destination_cache.get("u1") is MISSING
+    assert db._load_active_destination("u1")["url"] == "https://new.example.com"
+
+def test_settings_saved_during_load_are_not_hidden(temp_db, monkeypatch):
+    original_set = db.account_settings_cache.set
+
+    def set_after_concurrent_save(key, value, generation=None):
+        db.save_account_settings("u1", {"ingest_response": "minimal"}, "2024-01-01T00:00:00Z")
+        original_set(key, value, generation)
+
+    with monkeypatch.context() as m:
+        m.setattr(db.account_settings_cache, "set", set_after_concurrent_save)
+        assert db._load_account_settings("u1") == {}
+
+    assert db.account_settings_cache.get("u1") is MISSING
+    assert db._load_account_settings("u1") == {"ingest_response": "minimal"}
+
+def test_maxbytes_evicts_lru_to_fit():
+    cache = TTLCache(maxsize=10, ttl=60, maxbytes=10)
+    cache.set("a", b"xxxx")
+    cache.set("b", b"xxxx")
+    cache.get("a")  # b is now least recently used
+    cache.set("c", b"xxxx")
+
+    assert cache.get("b") is MISSING
+    assert cache.get("a") == b"xxxx" and cache.get("c") == b"xxxx"
+    assert cache.stats()["bytes"] == 8
+
+def test_value_over_maxbytes_is_not_cached():
+    cache = TTLCache(maxsize=10, ttl=60, maxbytes=10)
+    cache.set("a", b"xxxx")
+    cache.set("a", b"x" * 11)
+
+    assert cache.get("a") is MISSING
+    assert cache.stats()["bytes"] == 0
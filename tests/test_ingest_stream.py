@@ -0,0 +1,55 @@
+"""
+Streaming NDJSON ingest commits in chunks bounded by record count and by
+the raw bytes buffered, so large records don't pile up in memory.
+"""
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+
+USER = {"X-Demo-User": "u1"}
+HEADERS = {**USER, "content-type": "application/x-ndjson"}
+
+@pytest.fixture
+def client(temp_db, monkeypatch):
+    monkeypatch.setattr(main, "DELIVERY_WORKERS_IN_API", False)
+    with TestClient(main.app) as c:
+        c.post("/v1/destinations", json={"url": "https://example.com/hook"}, headers=USER)
+        yield c
+
+@pytest.fixture
+def chunks(monkeypatch):
+    """Number of records in each commit made by the stream endpoint."""
+    sizes = []
+    create = main.create_deliveries_async
+
+    async def recording_create(deliveries, payloads):
+        sizes.append(len(deliveries))
+        await create(deliveries, payloads)
+
+    monkeypatch.setattr(main, "create_deliveries_async", recording_create)
+    return sizes
+
+def ndjson(records):
+    return b"".join((json.dumps(r) + "\n").encode() for r in records)
+
+def test_chunks_flush_on_byte_budget(client, chunks, monkeypatch):
+    monkeypatch.setattr(main, "INGEST_STREAM_CHUNK_ITEMS", 500)
+    monkeypatch.setattr(main, "INGEST_STREAM_CHUNK_BYTES", 250_000)
+    body = ndjson({"event": "big", "pad": "x" * 100_000} for _ in range(10))
+
+    r = client.post("/v1/ingest/s", content=body, headers=HEADERS)
+
+    assert r.status_code == 200 and r.json()["accepted"] == 10
+    assert chunks == [3, 3, 3, 1]
+
+def test_chunks_flush_on_item_count(client, chunks, monkeypatch):
+    monkeypatch.setattr(main, "INGEST_STREAM_CHUNK_ITEMS", 4)
+    body = ndjson({"event": "small", "i": i} for i in range(10))
+
+    r = client.post("/v1/ingest/s", content=body, headers=HEADERS)
+
+    assert r.status_code == 200 and r.json()["accepted"] == 10
+    assert chunks == [4, 4, 2]
@@ -0,0 +1,50 @@
+"""
+The per-user listings must stay index range scans: SEARCH ... USING INDEX,
+with no TEMP B-TREE sort step, however many rows the user has.
+"""
+import pytest
+
+import db
+
+@pytest.fixture
+def conn(temp_db):
+    return db.get_conn()
+
+def query_plans(conn, fn, *args, **kwargs):
+    """Run fn and return the EXPLAIN QUERY PLAN lines of each SELECT it ran."""
+    statements = []
+    conn.set_trace_callback(statements.append)
+    try:
+        fn(*args, **kwargs)
+    finally:
+        conn.set_trace_callback(None)
+
+    plans = []
+    for sql in statements:
+        if sql.lstrip().upper().startswith("SELECT"):
+            plans.append([row["detail"] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}")])
+    assert plans, "no SELECT was run"
+    return plans
+
+def assert_index_search(plans, index):
+    for plan in plans:
+        assert any(line.startswith("SEARCH") and f"USING INDEX {index}" in line for line in plan), plan
+        assert not any("TEMP B-TREE" in line for line in plan), plan
+
+@pytest.mark.parametrize("kwargs", [
+    {},
+    {"after": ("2026-01-01T00:00:00.000000Z", "dly_x")},
+    {"since": "2026-01-01T00:00:00.000000Z", "until": "2026-02-01T00:00:00.000000Z"},
+    {"source": "github", "event_type": "push"},
+])
+def test_list_deliveries_for_user_uses_index(conn, kwargs):
+    plans = query_plans(conn, db.list_deliveries_for_user, "usr_1", 20, **kwargs)
+    assert_index_search(plans, "idx_deliveries_user_occurred_id")
+
+def test_active_destination_lookup_uses_index(conn):
+    plans = query_plans(conn, db._load_active_destination, "usr_1")
+    assert_index_search(plans, "idx_destinations_user_active_created")
+
+def test_list_destinations_uses_index(conn):
+    plans = query_plans(conn, db.list_destinations_db, "usr_1")
+    assert_index_search(plans, "idx_destinations_user_created")
@@ -0,0 +1,129 @@
+"""
+Delivery worker regressions: every delivery is POSTed exactly once, even
+while rows wait behind a destination's max_in_flight for longer than their
+lease, and the startup sweep leaves this run's own leases alone.
+"""
+import asyncio
+import json
+import time
+from collections import Counter
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+import db
+import main
+import worker
+
+USER = {"X-Demo-User": "u1"}
+
+@pytest.fixture
+def fast_worker(monkeypatch):
+    monkeypatch.setattr(worker, "DELIVERY_POLL_INTERVAL", 0.1)
+    monkeypatch.setattr(worker, "DELIVERY_LEASE_SECONDS", 1.0)
+    monkeypatch.setattr(worker, "DELIVERY_DESTINATION_MAX_IN_FLIGHT", 1)
+
+class Receiver:
+    """Counts the event ids POSTed to it; each POST takes `delay` seconds."""
+
+    def __init__(self):
+        self.sent = Counter()
+        self.delay = 0.0
+
+    async def handle(self, request):
+        await asyncio.sleep(self.delay)
+        body = json.loads(request.content)
+        for event in body if isinstance(body, list) else [body]:
+            self.sent[event["event_id"]] += 1
+        return httpx.Response(200)
+
+@pytest.fixture
+def receiver(monkeypatch):
+    """Builds the worker's HTTP client on a MockTransport to a Receiver."""
+    receiver = Receiver()
+    real_client = httpx.AsyncClient
+
+    def mock_client(**kwargs):
+        return real_client(transport=httpx.MockTransport(receiver.handle), timeout=kwargs.get("timeout"))
+
+    monkeypatch.setattr(httpx, "AsyncClient", mock_client)
+    return receiver
+
+def wait_until_settled(client, count: int, timeout: float):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        deliveries = client.get("/v1/deliveries", headers=USER).json()["deliveries"]
+        if len(deliveries) == count and all(d["status"] != "pending" for d in deliveries):
+            if worker.scheduler_stats()["in_flight"] == 0:
+                return deliveries
+        time.sleep(0.1)
+    pytest.fail("deliveries did not settle in time")
+
+@pytest.mark.parametrize("batch", [None, {"max_items": 2, "max_wait_ms": 50}])
+def test_rows_queued_past_their_lease_are_sent_once(temp_db, fast_worker, receiver, batch):
+    # 8 events, one POST at a time, 0.3 s each: the last rows wait ~2 s in
+    # this worker's queue, twice the 1 s lease they were claimed with
+    receiver.delay = 0.3
+    with TestClient(main.app) as client:
+        destination = {"url": "https://example.com/hook"}
+        if batch:
+            destination["batch"] = batch
+        client.post("/v1/destinations", json=destination, headers=USER)
+        client.post("/v1/ingest/s/batch", json=[{"i": i} for i in range(8)], headers=USER)
+
+        deliveries = wait_until_settled(client, 8, timeout=15)
+        time.sleep(worker.DELIVERY_LEASE_SECONDS)  # a duplicate would show up by now
+
+    assert [d["status"] for d in deliveries] == ["delivered"] * 8
+    assert len(receiver.sent) == 8
+    assert set(receiver.sent.values()) == {1}
+
+def test_startup_sweep_skips_leases_taken_by_this_run(temp_db, monkeypatch):
+    monkeypatch.setattr(main, "DELIVERY_WORKERS_IN_API", False)
+    with TestClient(main.app) as client:
+        client.post("/v1/destinations", json={"url": "https://example.com/hook"}, headers=USER)
+        client.post("/v1/ingest/s/batch", json=[{"i": i} for i in range(6)], headers=USER)
+
+    lease = 60.0
+    started_at = time.time()
+    conn = db.get_conn()
+    # Three rows leased by the previous run of this worker id, before it stopped
+    conn.execute(
+        "UPDATE deliveries SET claimed_by = ?, next_attempt_at = ? WHERE rowid <= 3",
+        ("wrk_test", started_at - 10 + lease),
+    )
+    conn.commit()
+    # ... and the other three claimed by this run after it started
+    claimed = db.claim_due_deliveries("wrk_test", started_at + 0.01, lease, limit=10, per_user_limit=10)
+    assert len(claimed) == 3
+
+    requeued = db.requeue_orphaned_deliveries("wrk_test", time.time(), started_at + lease, 100)
+
+    assert requeued == 3
+    rows = conn.execute("SELECT id, claimed_by FROM deliveries").fetchall()
+    still_claimed = {r["id"] for r in rows if r["claimed_by"] == "wrk_test"}
+    assert still_claimed == {d["id"] for d in claimed}
+
+def test_restart_recovers_previous_leases_and_sends_each_once(temp_db, receiver, monkeypatch):
+    monkeypatch.setattr(worker, "WORKER_ID", "wrk_test")
+    monkeypatch.setattr(worker, "DELIVERY_POLL_INTERVAL", 0.1)
+    monkeypatch.setattr(main, "DELIVERY_WORKERS_IN_API", False)
+    with TestClient(main.app) as client:
+        client.post("/v1/destinations", json={"url": "https://example.com/hook"}, headers=USER)
+        client.post("/v1/ingest/s/batch", json=[{"i": i} for i in range(9)], headers=USER)
+    conn = db.get_conn()
+    conn.execute(
+        "UPDATE deliveries SET claimed_by = 'wrk_test', next_attempt_at = ? WHERE rowid <= 3",
+        (time.time() + 50,),
+    )
+    conn.commit()
+
+    receiver.delay = 0.2
+    monkeypatch.setattr(main, "DELIVERY_WORKERS_IN_API", True)
+    with TestClient(main.app) as client:
+        wait_until_settled(client, 9, timeout=15)
+
+    assert worker.recovery_stats["recovered"] == 3
+    assert len(receiver.sent) == 9
+    assert set(receiver.sent.values()) == {1}
@@ -0,0 +1,43 @@
+"""
+Group commit: one bad op must not fail its batch, but a locked database
+must fail the batch once instead of waiting out busy_timeout per op.
+"""
+import sqlite3
+import time
+
+import db
+
+def _insert(cur, key):
+    cur.execute("INSERT INTO scratch (key) VALUES (?)", (key,))
+
+def _make_scratch():
+    conn = db.get_conn()
+    conn.execute("CREATE TABLE scratch (key TEXT PRIMARY KEY)")
+    conn.commit()
+
+def test_integrity_error_fails_only_its_op(temp_db):
+    _make_scratch()
+    errors = db._run_write_batch([(_insert, ("a",)), (_insert, ("a",)), (_insert, ("b",))])
+
+    assert errors[0] is None and errors[2] is None
+    assert isinstance(errors[1], sqlite3.IntegrityError)
+    keys = [r["key"] for r in db.get_conn().execute("SELECT key FROM scratch ORDER BY key")]
+    assert keys == ["a", "b"]
+
+def test_locked_database_fails_batch_once(temp_db, monkeypatch):
+    monkeypatch.setattr(db, "SQLITE_BUSY_TIMEOUT_MS", 200)
+    db.close_db()
+    _make_scratch()
+
+    locker = sqlite3.connect(temp_db)
+    locker.execute("BEGIN IMMEDIATE")
+    try:
+        started = time.monotonic()
+        errors = db._run_write_batch([(_insert, (str(i),)) for i in range(20)])
+        elapsed = time.monotonic() - started
+    finally:
+        locker.rollback()
+        locker.close()
+
+    assert all(isinstance(e, sqlite3.OperationalError) for e in errors)
+    assert elapsed < 1.0  # one busy_timeout, not one per op
@@ -0,0 +1,686 @@
+"""
+Delivery worker pool.
+
+Deliveries are queued durably in the `deliveries` table (status 'pending',
+due at next_attempt_at). A poller claims due rows and runs each attempt as a
+task, at most DELIVERY_WORKER_CONCURRENCY at a time. Retries are scheduled by
+writing a later next_attempt_at, so nothing is lost on restart.
+
+Runs inside the API process by default (see main.py), or standalone:
+
+    python worker.py
+"""
+import asyncio
+import logging
+import os
+import random
+import time
+import uuid
+from collections import Counter, OrderedDict, defaultdict, deque
+from functools import partial
+
+import httpx
+
+from db import (
+    init_db,
+    close_db,
+    claim_due_deliveries_async,
+    requeue_orphaned_deliveries_async,
+    renew_leases_async,
+    get_event_payload_json_async,
+    get_destination_async,
+    save_circuit_state_async,
+    update_delivery_async,
+    start_writer,
+    stop_writer
+)
+from breaker import CircuitBreaker, BREAKER_IDLE_SECONDS
+from cache import TTLCache, MISSING
+from envelope import encode_event, envelope_version
+
+logger = logging.getLogger(__name__)
+
+# Retry policy for outbound deliveries (all delays in seconds)
+DELIVERY_MAX_ATTEMPTS = int(os.getenv("DELIVERY_MAX_ATTEMPTS", "3"))
+DELIVERY_RETRY_BASE_DELAY = float(os.getenv("DELIVERY_RETRY_BASE_DELAY", "1.0"))
+DELIVERY_RETRY_MAX_DELAY = float(os.getenv("DELIVERY_RETRY_MAX_DELAY", "60.0"))
+DELIVERY_RETRY_JITTER = float(os.getenv("DELIVERY_RETRY_JITTER", "0.1"))
+
+# Worker pool. DELIVERY_WORKER_CONCURRENCY caps deliveries in flight across all
+# tenants. Each tenant may hold at most DELIVERY_TENANT_MAX_CLAIMED claimed rows
+# (queued or in flight) in this worker, and queued rows are started round-robin
+# across tenants, so one tenant's flood can't starve the others. Each destination
+# gets at most its max_in_flight (default DELIVERY_DESTINATION_MAX_IN_FLIGHT)
+# concurrent deliveries, so a flood can't overwhelm the receiver either.
+DELIVERY_WORKER_CONCURRENCY = int(os.getenv("DELIVERY_WORKER_CONCURRENCY", "50"))
+DELIVERY_TENANT_MAX_CLAIMED = int(os.getenv("DELIVERY_TENANT_MAX_CLAIMED", "10"))
+DELIVERY_DESTINATION_MAX_IN_FLIGHT = int(os.getenv("DELIVERY_DESTINATION_MAX_IN_FLIGHT", "5"))
+DELIVERY_POLL_INTERVAL = float(os.getenv("DELIVERY_POLL_INTERVAL", "0.5"))
+# A claimed row is invisible to other workers for this long. Rows waiting to
+# be sent have it renewed; an attempt is cut off before it runs out (see
+# attempt_budget), so it should comfortably exceed the HTTP timeouts.
+DELIVERY_LEASE_SECONDS = float(os.getenv("DELIVERY_LEASE_SECONDS", "60.0"))
+# An attempt is cut off this long (at most a tenth of the lease) before its
+# row's lease runs out
+DELIVERY_LEASE_MARGIN = float(os.getenv("DELIVERY_LEASE_MARGIN", "5.0"))
+# Identifies this worker's leases. Set a stable id, unique among the worker
+# processes running at once (render.yaml sets one for its single process), so a
+# restarted worker reclaims its own in-flight rows immediately. Without it each
+# run gets a random id: the startup sweep then can't match the previous run's
+# leases, and those rows wait for their leases to expire instead.
+WORKER_ID_IS_STABLE = bool(os.getenv("DELIVERY_WORKER_ID"))
+WORKER_ID = os.getenv("DELIVERY_WORKER_ID") or f"wrk_{uuid.uuid4().hex}"
+
+# Rows held in outbound batch buffers (destinations with batching enabled)
+# count against this limit rather than DELIVERY_WORKER_CONCURRENCY.
+DELIVERY_BATCH_BUFFER_MAX = int(os.getenv("DELIVERY_BATCH_BUFFER_MAX", "10000"))
+
+# Serialized event bodies by (event id, envelope version), so retries and replays of a recent event
+# skip the events-table read and just resend the same bytes. Bounded by count and by total bytes;
+# a body bigger than EVENT_BODY_CACHE_MAX_BYTES is just not cached.
+EVENT_BODY_CACHE_SIZE = int(os.getenv("EVENT_BODY_CACHE_SIZE", "1000"))
+EVENT_BODY_CACHE_MAX_BYTES = int(os.getenv("EVENT_BODY_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+EVENT_BODY_CACHE_TTL = float(os.getenv("EVENT_BODY_CACHE_TTL", "300"))
+event_body_cache = TTLCache(EVENT_BODY_CACHE_SIZE, EVENT_BODY_CACHE_TTL, maxbytes=EVENT_BODY_CACHE_MAX_BYTES)
+
+JSON_HEADERS = {"Content-Type": "application/json"}
+
+# Startup recovery sweep, in batches so a big backlog doesn't hold the loop
+RECOVERY_BATCH_SIZE = int(os.getenv("DELIVERY_RECOVERY_BATCH_SIZE", "500"))
+
+# Outbound HTTP pool, shared by all deliveries so repeated webhooks to the same
+# destination reuse warm keep-alive connections instead of a new TCP/TLS handshake.
+# HTTP/2 needs the optional `h2` package (pip install "httpx[http2]").
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", "20"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30.0"))
+# Default per-attempt timeouts, in seconds; a destination may override each
+# (timeout_connect/read/write/pool). HTTP_TIMEOUT is the read/write default.
+# Connect and pool-acquire are short so a dead receiver or a saturated pool
+# fails fast instead of holding a worker slot.
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "10.0"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5.0"))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", str(HTTP_TIMEOUT)))
+HTTP_WRITE_TIMEOUT = float(os.getenv("HTTP_WRITE_TIMEOUT", str(HTTP_TIMEOUT)))
+HTTP_POOL_TIMEOUT = float(os.getenv("HTTP_POOL_TIMEOUT", "5.0"))
+HTTP2_ENABLED = os.getenv("HTTP2_ENABLED", "0") == "1"
+
+http_client: httpx.AsyncClient | None = None
+
+_poller: asyncio.Task | None = None
+_in_flight: set[asyncio.Task] = set()
+_wakeup: asyncio.Event | None = None
+_recovery: asyncio.Task | None = None
+
+# Scheduler state: claimed rows waiting to start, per tenant (round-robin order),
+# rows held per tenant (queued + in flight), and tasks in flight per destination.
+_ready: OrderedDict[str, deque] = OrderedDict()
+_held_by_user: defaultdict[str, int] = defaultdict(int)
+_in_flight_by_destination: defaultdict[str, int] = defaultdict(int)
+_last_claimed_user: str | None = None
+# Claimed rows this worker holds (queued, buffered or in flight), refcounted
+# by the tasks/buffers holding them. Claimed rows can wait in _ready behind a
+# destination's cap; their leases are renewed while they wait (_renew_leases),
+# and if one expires anyway and the row is claimed again, the copy is dropped.
+_held_ids: Counter[str] = Counter()
+# Rows released while a claim was running: the claim may have read them
+# before their outcome was written, so they are dropped from it too
+_released_during_claim: set[str] | None = None
+
+# destination_id -> {"destination", "rows", "bodies", "bytes", "timer"}
+_batches: dict[str, dict] = {}
+_buffered = 0
+
+# Circuit breaker per destination URL (see breaker.py). Idle closed breakers
+# are dropped every BREAKER_IDLE_SECONDS, so this only holds recently used URLs.
+breakers: dict[str, CircuitBreaker] = {}
+_breakers_swept_at = time.time()
+
+# Startup sweep (see recover_orphaned_deliveries). "recovered" counts only the
+# rows it requeued; leases it can't match just expire and aren't counted.
+recovery_stats = {"running": False, "recovered": 0, "duration_seconds": None}
+
+def retry_delay(attempt: int) -> float:
+    """
+    Exponential backoff after the given (1-based) attempt: base, 2*base, 4*base...
+    capped at DELIVERY_RETRY_MAX_DELAY, then spread by +/- DELIVERY_RETRY_JITTER
+    (a fraction of the delay) so retries to one destination don't line up.
+    """
+    delay = min(DELIVERY_RETRY_BASE_DELAY * (2 ** (attempt - 1)), DELIVERY_RETRY_MAX_DELAY)
+    if DELIVERY_RETRY_JITTER:
+        delay *= 1 + random.uniform(-DELIVERY_RETRY_JITTER, DELIVERY_RETRY_JITTER)
+    return max(delay, 0.0)
+
+class CircuitOpen(Exception):
+    def __init__(self, retry_at: float):
+        super().__init__("Circuit open")
+        self.retry_at = retry_at
+
+def request_timeout(destination: dict | None, deadline_at: float | None = None) -> httpx.Timeout:
+    """
+    httpx timeouts for one attempt: the destination's profile over the worker
+    defaults, each cut down to what's left before deadline_at.
+    """
+    timeouts = {
+        "connect": HTTP_CONNECT_TIMEOUT,
+        "read": HTTP_READ_TIMEOUT,
+        "write": HTTP_WRITE_TIMEOUT,
+        "pool": HTTP_POOL_TIMEOUT,
+    }
+    if destination:
+        for key in timeouts:
+            if destination[f"timeout_{key}"]:
+                timeouts[key] = destination[f"timeout_{key}"]
+    if deadline_at is not None:
+        remaining = max(deadline_at - time.time(), 0.001)
+        timeouts = {key: min(value, remaining) for key, value in timeouts.items()}
+    return httpx.Timeout(**timeouts)
+
+def attempt_budget(deliveries: list[dict], deadline_at: float | None = None) -> float:
+    """
+    Wall-clock seconds one attempt may take: until the earliest lease among
+    `deliveries` runs out (less a safety margin, so the row isn't claimed
+    again while we're still sending it), and no later than deadline_at.
+    httpx's timeouts are per phase and per read, so they can't promise this.
+    """
+    now = time.time()
+    margin = min(DELIVERY_LEASE_MARGIN, DELIVERY_LEASE_SECONDS / 10)
+    budget = min(d["next_attempt_at"] for d in deliveries) - margin - now
+    if deadline_at is not None:
+        budget = min(budget, deadline_at - now)
+    return max(budget, 0.001)
+
+def past_deadline(delivery: dict) -> bool:
+    return delivery["deadline_at"] is not None and time.time() >= delivery["deadline_at"]
+
+def get_breaker(url: str) -> CircuitBreaker:
+    breaker = breakers.get(url)
+    if breaker is None:
+        breaker = breakers[url] = CircuitBreaker()
+    return breaker
+
+async def dispatch(delivery: dict, destination: dict | None):
+    """Send a claimed row on its own, or buffer it if its destination batches."""
+    if past_deadline(delivery):
+        await update_delivery_async(
+            delivery_id=delivery["id"],
+            status="failed",
+            attempts=delivery["attempts"],
+            last_error="Delivery deadline exceeded"
+        )
+        return
+
+    breaker = breakers.get(delivery["destination_url"])
+    if breaker is not None and breaker.is_open():
+        await park(delivery, breaker.retry_at())
+        return
+
+    if destination and destination["batch_max_items"]:
+        await add_to_batch(destination, delivery)
+    else:
+        await attempt_delivery(delivery, destination)
+
+async def load_event(delivery: dict, version: int):
+    """
+    The serialized event envelope (bytes) for a delivery, or None (recorded as
+    failed) if its payload is gone.
+    """
+    cache_key = (delivery["event_id"], version)
+    body = event_body_cache.get(cache_key)
+    if body is not MISSING:
+        return body
+
+    payload_json = (
+        await get_event_payload_json_async(delivery["event_id"]) if delivery["event_id"] else None
+    )
+    if payload_json is None:
+        await update_delivery_async(
+            delivery_id=delivery["id"],
+            status="failed",
+            attempts=delivery["attempts"],
+            last_error="Event payload not available"
+        )
+        return None
+
+    body = encode_event(
+        delivery["event_id"],
+        delivery["source"],
+        delivery["event_type"],
+        delivery["occurred_at"],
+        payload_json,
+        version
+    )
+    event_body_cache.set(cache_key, body)
+    return body
+
+async def post(url: str, budget: float, **kwargs):
+    """
+    POST to a destination through its circuit breaker, giving up after
+    `budget` seconds in total. Returns None on 2xx, else the error to record.
+    Raises CircuitOpen if the breaker refuses.
+    """
+    breaker = get_breaker(url)
+    state_before = breaker.state
+    if not breaker.allow():
+        await _save_circuit_state(url, breaker, state_before)
+        raise CircuitOpen(breaker.retry_at())
+    probe = breaker.is_probing()
+
+    error = None
+    healthy = True
+    try:
+        async with asyncio.timeout(budget):
+            resp = await http_client.post(url, **kwargs)
+
+        # Consider 2xx as success
+        if not 200 <= resp.status_code < 300:
+            # Non-2xx = failure worth retrying. Only 5xx/429 say the receiver
+            # itself is in trouble; other 4xx don't count against the breaker.
+            error = f"Non-2xx response: {resp.status_code}"
+            healthy = resp.status_code < 500 and resp.status_code != 429
+
+    except TimeoutError:
+        error = f"Attempt timed out after {budget:.1f}s"
+        healthy = False
+
+    except Exception as e:
+        error = str(e)
+        healthy = False
+
+    breaker.record(healthy, probe)
+    await _save_circuit_state(url, breaker, state_before)
+    return error
+
+async def _save_circuit_state(url: str, breaker: CircuitBreaker, state_before: str):
+    if breaker.state == state_before:
+        return
+    try:
+        await save_circuit_state_async(url, breaker.snapshot())
+    except Exception:
+        logger.exception("delivery worker: could not save circuit state for %s", url)
+
+async def park(delivery: dict, retry_at: float):
+    """
+    Put a delivery back in the queue until its destination's breaker lets
+    attempts through again. Doesn't use up an attempt.
+    """
+    await update_delivery_async(
+        delivery_id=delivery["id"],
+        status="pending",
+        attempts=delivery["attempts"],
+        last_error="Circuit open: destination is failing, delivery parked",
+        # Spread parked rows out so they don't all come back at once
+        next_attempt_at=retry_at + random.uniform(0, 1)
+    )
+
+async def record_attempt(delivery: dict, last_error: str | None):
+    """
+    Record the outcome of one attempt: delivered, pending with a backed-off
+    next_attempt_at, or failed once DELIVERY_MAX_ATTEMPTS is used up or the
+    next retry would fall after the delivery's deadline.
+    """
+    attempt = delivery["attempts"] + 1
+
+    if last_error is None:
+        status, next_attempt_at = "delivered", None
+    elif attempt >= DELIVERY_MAX_ATTEMPTS:
+        status, next_attempt_at = "failed", None
+    else:
+        status, next_attempt_at = "pending", time.time() + retry_delay(attempt)
+        if delivery["deadline_at"] is not None and next_attempt_at >= delivery["deadline_at"]:
+            status, next_attempt_at = "failed", None
+
+    await update_delivery_async(
+        delivery_id=delivery["id"],
+        status=status,
+        attempts=attempt,
+        last_error=last_error,
+        next_attempt_at=next_attempt_at
+    )
+
+async def attempt_delivery(delivery: dict, destination: dict | None = None):
+    """Make one attempt at a claimed delivery row and record the outcome."""
+    body = await load_event(delivery, envelope_version(destination))
+    if body is None:
+        return
+
+    try:
+        last_error = await post(
+            delivery["destination_url"],
+            attempt_budget([delivery], delivery["deadline_at"]),
+            content=body,
+            headers=JSON_HEADERS,
+            timeout=request_timeout(destination, delivery["deadline_at"])
+        )
+    except CircuitOpen as e:
+        await park(delivery, e.retry_at)
+        return
+    await record_attempt(delivery, last_error)
+
+async def add_to_batch(destination: dict, delivery: dict):
+    """
+    Buffer a delivery for its destination's next batch. The batch is sent
+    when it reaches batch_max_items or batch_max_bytes, or batch_max_wait_ms
+    after its first event arrived, whichever comes first.
+    """
+    global _buffered
+    body = await load_event(delivery, envelope_version(destination))
+    if body is None:
+        return
+
+    batch = _batches.get(destination["id"])
+    if batch and batch["bytes"] + len(body) > destination["batch_max_bytes"]:
+        flush_batch(destination["id"])
+        batch = None
+
+    if batch is None:
+        batch = {"destination": destination, "rows": [], "bodies": [], "bytes": 2, "timer": None}
+        batch["timer"] = asyncio.get_running_loop().call_later(
+            destination["batch_max_wait_ms"] / 1000, flush_batch, destination["id"]
+        )
+        _batches[destination["id"]] = batch
+
+    batch["rows"].append(delivery)
+    batch["bodies"].append(body)
+    _held_ids[delivery["id"]] += 1  # released when the batch's task is done
+    batch["bytes"] += len(body) + 1
+    _buffered += 1
+
+    if len(batch["rows"]) >= destination["batch_max_items"]:
+        flush_batch(destination["id"])
+
+def flush_batch(destination_id: str):
+    global _buffered
+    batch = _batches.pop(destination_id, None)
+    if batch is None:
+        return
+    batch["timer"].cancel()
+    _buffered -= len(batch["rows"])
+    _track(
+        attempt_batch(batch["destination"], batch["rows"], batch["bodies"]),
+        destination_id,
+        delivery_ids=[d["id"] for d in batch["rows"]]
+    )
+
+async def attempt_batch(destination: dict, deliveries: list[dict], bodies: list[bytes]):
+    """POST buffered events as one JSON array; every delivery shares the outcome."""
+    try:
+        last_error = await post(
+            destination["url"],
+            # Not cut to any one row's deadline; record_attempt applies those
+            attempt_budget(deliveries),
+            content=b"[" + b",".join(bodies) + b"]",
+            headers=JSON_HEADERS,
+            timeout=request_timeout(destination)
+        )
+    except CircuitOpen as e:
+        await asyncio.gather(*(park(d, e.retry_at) for d in deliveries))
+        return
+    await asyncio.gather(*(record_attempt(d, last_error) for d in deliveries))
+
+def notify():
+    """Wake the poller now (e.g. right after ingest) instead of at the next tick."""
+    if _wakeup is not None:
+        _wakeup.set()
+
+def destination_key(delivery: dict) -> str:
+    # Rows from before destination_id existed are grouped by URL
+    return delivery["destination_id"] or delivery["destination_url"]
+
+def _track(coro, destination_key: str, user_id: str | None = None, delivery_ids=()):
+    task = asyncio.create_task(coro)
+    _in_flight.add(task)
+    _in_flight_by_destination[destination_key] += 1
+    task.add_done_callback(partial(_on_task_done, destination_key, user_id, delivery_ids))
+
+def _on_task_done(destination_key: str, user_id: str | None, delivery_ids, task: asyncio.Task):
+    _in_flight.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        # The rows stay leased and are retried once the lease runs out
+        logger.error("delivery worker: delivery task failed", exc_info=task.exception())
+    for delivery_id in delivery_ids:
+        _held_ids[delivery_id] -= 1
+        if not _held_ids[delivery_id]:
+            del _held_ids[delivery_id]
+            if _released_during_claim is not None:
+                _released_during_claim.add(delivery_id)
+    _in_flight_by_destination[destination_key] -= 1
+    if not _in_flight_by_destination[destination_key]:
+        del _in_flight_by_destination[destination_key]
+    if user_id is not None:
+        _held_by_user[user_id] -= 1
+        if not _held_by_user[user_id]:
+            del _held_by_user[user_id]
+    if _poller is not None:
+        schedule()
+        notify()  # capacity freed up
+
+def schedule():
+    """
+    Start queued deliveries, one per tenant per round, until the global cap is
+    reached. A tenant whose next delivery's destination is at its max_in_flight
+    is skipped (not blocked on) until one of those deliveries finishes.
+    """
+    progressed = True
+    while progressed:
+        progressed = False
+        for user_id in list(_ready):
+            if len(_in_flight) >= DELIVERY_WORKER_CONCURRENCY:
+                return
+            queue = _ready[user_id]
+            delivery, destination = queue[0]
+            key = destination_key(delivery)
+            limit = (destination or {}).get("max_in_flight") or DELIVERY_DESTINATION_MAX_IN_FLIGHT
+            if _in_flight_by_destination[key] >= limit:
+                continue
+
+            queue.popleft()
+            if queue:
+                _ready.move_to_end(user_id)
+            else:
+                del _ready[user_id]
+            _track(dispatch(delivery, destination), key, user_id, (delivery["id"],))
+            progressed = True
+
+def scheduler_stats() -> dict:
+    return {
+        "in_flight": len(_in_flight),
+        "queued": sum(len(q) for q in _ready.values()),
+        "buffered_for_batches": _buffered,
+        "tenants_with_claims": len(_held_by_user),
+        "destinations_in_flight": len(_in_flight_by_destination),
+    }
+
+def _drop_idle_breakers():
+    global _breakers_swept_at
+    now = time.time()
+    if now - _breakers_swept_at < BREAKER_IDLE_SECONDS:
+        return
+    _breakers_swept_at = now
+    for url in [url for url, breaker in breakers.items() if breaker.is_idle(now)]:
+        del breakers[url]
+
+def breaker_stats() -> dict:
+    counts = defaultdict(int)
+    for breaker in breakers.values():
+        counts[breaker.state] += 1
+    return {"destinations": len(breakers), **counts}
+
+async def _renew_leases():
+    """
+    Renew the leases of claimed rows still waiting to be sent (queued or in a
+    batch buffer) before they run out, so they aren't claimed again, by this
+    worker or another.
+    """
+    now = time.time()
+    threshold = max(DELIVERY_LEASE_SECONDS / 2, 2 * DELIVERY_POLL_INTERVAL)
+    waiting = [row for queue in _ready.values() for row, _ in queue]
+    waiting += [row for batch in _batches.values() for row in batch["rows"]]
+    expiring = [row for row in waiting if row["next_attempt_at"] - now < threshold]
+    if not expiring:
+        return
+
+    until = now + DELIVERY_LEASE_SECONDS
+    await renew_leases_async(WORKER_ID, [row["id"] for row in expiring], until)
+    for row in expiring:
+        row["next_attempt_at"] = until
+
+async def _claim() -> bool:
+    """Claim due rows into the tenant queues. True if the claim came back full."""
+    global _last_claimed_user, _released_during_claim
+    held = sum(_held_by_user.values())
+    # Claim enough to keep every slot busy plus one round of queued work
+    limit = min(
+        2 * DELIVERY_WORKER_CONCURRENCY - held,
+        DELIVERY_BATCH_BUFFER_MAX - _buffered
+    )
+    if limit <= 0:
+        return False
+
+    _released_during_claim = set()
+    try:
+        rows = await claim_due_deliveries_async(
+            WORKER_ID,
+            time.time(),
+            DELIVERY_LEASE_SECONDS,
+            limit,
+            DELIVERY_TENANT_MAX_CLAIMED,
+            {u: max(DELIVERY_TENANT_MAX_CLAIMED - n, 0) for u, n in _held_by_user.items()},
+            _last_claimed_user
+        )
+    finally:
+        released, _released_during_claim = _released_during_claim, None
+    full = len(rows) == limit
+
+    # Already held here (its lease ran out while it waited), or finished
+    # while the claim ran: sending it again would be a duplicate
+    rows = [r for r in rows if r["id"] not in _held_ids and r["id"] not in released]
+
+    for row in rows:
+        _held_ids[row["id"]] += 1  # released when its dispatch task is done
+        destination = None
+        if row["destination_id"]:
+            destination = await get_destination_async(row["destination_id"])
+        if row["user_id"] not in _ready:
+            _ready[row["user_id"]] = deque()
+        _ready[row["user_id"]].append((row, destination))
+        _held_by_user[row["user_id"]] += 1
+    if rows:
+        _last_claimed_user = rows[-1]["user_id"]
+        schedule()
+    return full
+
+async def _poll_loop():
+    while True:
+        _wakeup.clear()
+
+        _drop_idle_breakers()
+        try:
+            await _renew_leases()
+            # A full claim probably means more rows are due; go again right away
+            if await _claim():
+                continue
+        except Exception:
+            logger.exception("delivery worker: claim failed")
+
+        try:
+            await asyncio.wait_for(_wakeup.wait(), timeout=DELIVERY_POLL_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+
+async def recover_orphaned_deliveries(started_at: float):
+    """
+    Re-enqueue pending deliveries left behind by a previous run with this
+    WORKER_ID (or never queued), one batch at a time, yielding to the event
+    loop between batches. Runs alongside the poller, so it only touches
+    leases taken before `started_at`.
+    """
+    recovery_stats.update(running=True, recovered=0, duration_seconds=None)
+    started = time.monotonic()
+    try:
+        while True:
+            count = await requeue_orphaned_deliveries_async(
+                WORKER_ID, time.time(), started_at + DELIVERY_LEASE_SECONDS, RECOVERY_BATCH_SIZE
+            )
+            recovery_stats["recovered"] += count
+            if count:
+                notify()
+            if count < RECOVERY_BATCH_SIZE:
+                break
+            await asyncio.sleep(0)
+    finally:
+        recovery_stats["running"] = False
+        recovery_stats["duration_seconds"] = round(time.monotonic() - started, 3)
+    logger.info(
+        "delivery worker: recovered %d orphaned deliveries in %ss",
+        recovery_stats["recovered"], recovery_stats["duration_seconds"]
+    )
+
+async def start_workers():
+    global http_client, _poller, _wakeup, _recovery
+    http_client = httpx.AsyncClient(
+        timeout=request_timeout(None),
+        limits=httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+        ),
+        http2=HTTP2_ENABLED,
+    )
+    if not WORKER_ID_IS_STABLE:
+        logger.warning(
+            "delivery worker: DELIVERY_WORKER_ID is not set; leases left by a previous "
+            "run will not be recovered at startup and are retried when they expire"
+        )
+    started_at = time.time()
+    _wakeup = asyncio.Event()
+    _poller = asyncio.create_task(_poll_loop())
+    # Runs in the background so startup (and readiness) doesn't wait on it
+    _recovery = asyncio.create_task(recover_orphaned_deliveries(started_at))
+
+async def stop_workers():
+    """
+    Stop claiming and cancel attempts in progress, and drop unsent batches.
+    Their rows stay pending and are retried (by this or another worker) once
+    their lease expires.
+    """
+    global http_client, _poller, _wakeup, _recovery, _buffered, _last_claimed_user
+    for batch in _batches.values():
+        batch["timer"].cancel()
+    _batches.clear()
+    _buffered = 0
+    if _poller is not None:
+        tasks = [_poller, _recovery, *_in_flight]
+        _poller = None
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        _recovery = None
+        _wakeup = None
+    _in_flight.clear()
+    _ready.clear()
+    _held_by_user.clear()
+    _held_ids.clear()
+    _in_flight_by_destination.clear()
+    _last_claimed_user = None
+    if http_client is not None:
+        await http_client.aclose()
+        http_client = None
+
+async def main():
+    init_db()
+    await start_writer()
+    await start_workers()
+    try:
+        await asyncio.Event().wait()  # run until cancelled (Ctrl+C)
+    finally:
+        await stop_workers()
+        await stop_writer()
+        close_db()
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass